@@ -1,14 +1,11 @@
 import streamlit as st
-import asyncio
-import aiohttp
-import io
-from PIL import Image
-import numpy as np
 
 # Adjust python path if needed or rely on src package
 import sys
 import os
 import subprocess
+import tempfile
+from collections import deque
 
 # Ensure Playwright browsers are installed
 def ensure_playwright_installed():
@@ -43,9 +40,21 @@ sys.path.append(os.getcwd())
 from src.scrapers.tumblr import TumblrScraper
 from src.scrapers.google import GoogleScraper
 from src.scrapers.pinterest import PinterestScraper
+from src.scrapers.multi import search_all_pooled
 from src.ai.processor import ImageProcessor
-from src.utils.downloader import download_images_parallel, download_image
-from src.utils.exporter import create_dataset_zip, generate_filename
+from src.ai.embedding_store import EmbeddingStore
+from src.ai.ann import IVFIndex
+from src.utils.downloader import (download_images_parallel, fetch_image_bytes, prefetch_images,
+                                  DEFAULT_LIMITS, EMBED_DRAFT_SIZE)
+from src.utils.exporter import (ExportEntry, ExportOptions, generate_filename, make_export_executor, parquet_available,
+                                write_dataset_zip, write_parquet)
+from src.utils.export_manifest import sync_dataset_dir, sync_webdataset
+from src.utils.pipeline import stream_embeddings
+from src.utils.http_cache import DiskCache
+from src.utils.http_session import get_session_manager
+from src.utils.image_cache import ImageCache
+from src.utils.thumbnails import ThumbnailCache
+from src.utils.importer import import_images, known_local_hashes, zip_members
 
 
 # --- Configuration & Styling ---
@@ -68,10 +77,16 @@ if "scraped_urls" not in st.session_state:
     st.session_state.scraped_urls = [] # List of URL strings
 if "basket" not in st.session_state:
     st.session_state.basket = set() # Set of URLs
+if "negatives" not in st.session_state:
+    st.session_state.negatives = set() # URLs marked "not this", pushed down by contrast ranking
 if "embeddings" not in st.session_state:
-    st.session_state.embeddings = {} # url -> np.network
-if "images_cache" not in st.session_state:
-    st.session_state.images_cache = {} # url -> PIL.Image (LRU-like manual management if needed, but for now allow unrestricted RAM usage as per request)
+    st.session_state.embeddings = IVFIndex() # url -> normalized row; switches to approximate search for very large collections
+if "image_meta" not in st.session_state:
+    st.session_state.image_meta = {} # url -> ScrapedImage (query that found it; size/caption reported by the site, when known)
+
+# With approximate search active, "Similar" ranks at most this many images and the
+# rest keep their order below them. Exact search always ranks everything.
+SIMILAR_TOP_K = 1000
 
 # --- Resources ---
 @st.cache_resource
@@ -80,164 +95,507 @@ def get_processor():
 
 processor = get_processor()
 
+@st.cache_resource
+def get_embedding_store(model_name):
+    # Shared across sessions so embeddings survive reloads and restarts
+    return EmbeddingStore(model_name)
+
+embedding_store = get_embedding_store(processor.model_name)
+
+@st.cache_resource
+def get_http_cache():
+    # Raw image downloads, so re-scraping overlapping queries hits disk instead of the CDN
+    return DiskCache()
+
+http_cache = get_http_cache()
+
+# Per-session memory budget for image bytes; the overflow goes to http_cache
+IMAGE_CACHE_BYTES = 256 * 1024 * 1024
+if "images_cache" not in st.session_state:
+    st.session_state.images_cache = ImageCache(IMAGE_CACHE_BYTES, spill=http_cache) # url -> compressed bytes, decoded on access
+if "thumbnail_failures" not in st.session_state:
+    st.session_state.thumbnail_failures = set() # urls we couldn't fetch a preview for, not retried on every rerun
+
+# Longest side of the grid previews, in pixels
+THUMBNAIL_SIZE = 320
+# Live preview while images are being analyzed: the newest arrivals, this many per row
+LIVE_PREVIEW_COUNT = 24
+LIVE_PREVIEW_COLUMNS = 8
+
+@st.cache_resource
+def get_thumbnails(size):
+    return ThumbnailCache(size=size, store=http_cache)
+
+thumbnails = get_thumbnails(THUMBNAIL_SIZE)
+
+@st.cache_resource
+def get_export_executor():
+    # Resize/encode for exports on every core; started lazily by the first export that converts
+    return make_export_executor()
+
+# One warm connection pool (keep-alive, DNS cache, per-host limits) for every download in the process
+sessions = get_session_manager()
+
 # --- helper functions ---
-async def download_and_embed(urls):
+def download_and_embed(urls):
     """
     Downloads images that aren't in cache, and computes embeddings for them.
+    Downloads, decoding and embedding overlap on the session manager's loop;
+    the progress bar and a live preview grid at the top of the page fill in as
+    batches finish.
+    Downloads are only decoded at CLIP resolution (draft mode) and not kept in the
+    image cache; export fetches the full-size originals itself.
     Updates session_state.
     """
+    index = st.session_state.embeddings
+    cache = st.session_state.images_cache
+    urls = list(dict.fromkeys(urls))
+
     # Filter out local images from download list, they are already in cache if present
-    # Local images have "local::" prefix
-    urls_to_download = [u for u in urls if not u.startswith("local::")]
-    
-    missing_urls = [u for u in urls_to_download if u not in st.session_state.images_cache]
-    
-    if missing_urls:
-        with st.spinner(f"Downloading {len(missing_urls)} images for analysis..."):
-            # Custom downloader
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-            }
-            connector = aiohttp.TCPConnector(limit=20)
-            async with aiohttp.ClientSession(connector=connector, headers=headers) as session:
-                 # Reconstruct download_images_parallel inline or import
-                 # Importing helper
-                 from src.utils.downloader import download_image
-                 tasks = [download_image(session, url) for url in missing_urls]
-                 results = await asyncio.gather(*tasks)
-                 
-            for url, img in results:
-                if img:
-                     st.session_state.images_cache[url] = img
-    
-    # Compute embeddings for new images (local or downloaded)
-    valid_urls_to_embed = [u for u in urls if u in st.session_state.images_cache and u not in st.session_state.embeddings]
-    
+    # Local images have "local::" prefix. Earlier downloads that only live in the disk
+    # cache count as missing: the fetch is answered from disk without a request.
+    missing_urls = [u for u in urls if not u.startswith("local::") and u not in cache and u not in index]
+    # Cached images (local or downloaded earlier) only need decoding and embedding.
+    # Read one at a time as the pipeline gets to them, so spilled ones aren't all
+    # loaded back at once; a spilled download evicted since is fetched again there.
+    cached_to_embed = {u: (lambda u=u: cache.get_bytes(u, admit=False)) for u in urls if u in cache and u not in index}
+
+    total = len(missing_urls) + len(cached_to_embed)
+    if not total:
+        return 0
+
+    progress = st.progress(0.0, text=f"Analyzing {total} images...")
+    processed = 0
     newly_embedded = 0
-    if valid_urls_to_embed:
-        with st.spinner(f"Computing embeddings for {len(valid_urls_to_embed)} images..."):
-             images = [st.session_state.images_cache[u] for u in valid_urls_to_embed]
-             # Batch processing
-             embeddings = processor.encode_images(images)
-             for i, url in enumerate(valid_urls_to_embed):
-                 st.session_state.embeddings[url] = embeddings[i]
-             newly_embedded = len(valid_urls_to_embed)
-    
-    return newly_embedded
+    # The newest arrivals, as decoded for the model (already small, nothing to re-encode)
+    recent = deque(maxlen=LIVE_PREVIEW_COUNT)
+    batches = stream_embeddings(missing_urls, processor, embedding_store, image_bytes=cached_to_embed,
+                                draft_size=EMBED_DRAFT_SIZE, cache=http_cache,
+                                session=sessions.session, limiter=sessions.limiter)
+    for batch in sessions.iterate(batches):
+        new_urls = [u for u in batch.urls if u not in index]
+        index.add_many(batch.urls, batch.embeddings)
+
+        newly_embedded += len(new_urls)
+        processed += len(batch.urls)
+        progress.progress(min(processed / total, 1.0), text=f"Analyzed {processed}/{total} images...")
+        recent.extend(batch.images)
+        with live_grid.container():
+            st.caption(f"Analyzed {processed}/{total} images, newest first")
+            cols = st.columns(LIVE_PREVIEW_COLUMNS)
+            for i, image in enumerate(reversed(recent)):
+                cols[i % LIVE_PREVIEW_COLUMNS].image(image, use_container_width=True)
+    progress.empty()
+    live_grid.empty()
 
     return newly_embedded
 
-def find_similar(target_url, source_list=None):
+def grid_thumbnails(keys):
+    """
+    Thumbnails for the grid cells in keys ({key: bytes or None}).
+    Made once from the cached file; images we don't have yet are downloaded
+    (in parallel, decoded in draft mode) just to make their thumbnail.
+    """
+    cache = st.session_state.images_cache
+    failures = st.session_state.thumbnail_failures
+    thumbs = {}
+    to_download = []
+    for key in keys:
+        thumbs[key] = thumbnails.get_or_make(key, lambda: cache.get_bytes(key, admit=False))
+        if thumbs[key] is None and not key.startswith("local::") and key not in failures:
+            to_download.append(key)
+
+    if to_download:
+        with st.spinner(f"Loading {len(to_download)} previews..."):
+            report = sessions.run(download_images_parallel(to_download, draft_size=THUMBNAIL_SIZE, cache=http_cache,
+                                                           session=sessions.session, limiter=sessions.limiter))
+        for url, image in report.images.items():
+            thumbs[url] = thumbnails.put_image(url, image)
+        failures.update(report.failures)
+    return thumbs
+
+PAGE_SIZES = [24, 48, 100, 200]
+
+def show_first_page(grid):
+    """
+    Sends a grid back to page 1 on the next render (after a re-rank or a new scrape).
+    Safe to call after the paging widgets were drawn.
+    """
+    st.session_state[f"{grid}_page_reset"] = True
+
+def reset_checkboxes():
+    """
+    Drops every selection checkbox's own state so they're re-initialized from the basket
+    (and the "not this" ones from the negatives).
+    Needed whenever the basket changes from outside the checkboxes.
+    """
+    for key in list(st.session_state.keys()):
+        if key.startswith(("sel_", "l_sel_", "neg_", "l_neg_")):
+            del st.session_state[key]
+
+def _step_page(page_key, step, pages):
+    st.session_state[page_key] = min(max(st.session_state[page_key] + step, 1), pages)
+
+def paginate(items, grid):
+    """
+    Draws paging controls (prev/next, jump-to page, page size) for a grid and returns
+    the items on the current page. Only those get rendered, so a rerun costs one
+    page whatever the total.
+    """
+    page_key, size_key = f"{grid}_page", f"{grid}_page_size"
+    if size_key not in st.session_state:
+        st.session_state[size_key] = PAGE_SIZES[1]
+    page_size = st.session_state[size_key]
+    pages = max(1, -(-len(items) // page_size))
+    # Fix the page before its widget exists: the list may have shrunk since the last run
+    if st.session_state.pop(f"{grid}_page_reset", False) or page_key not in st.session_state:
+        st.session_state[page_key] = 1
+    st.session_state[page_key] = min(st.session_state[page_key], pages)
+
+    c_prev, c_page, c_next, c_size, c_info = st.columns([1, 1, 1, 1, 2])
+    with c_prev:
+        st.button("◀ Prev", key=f"{grid}_prev", on_click=_step_page, args=(page_key, -1, pages),
+                  disabled=st.session_state[page_key] <= 1)
+    with c_page:
+        st.number_input("Page", min_value=1, max_value=pages, step=1, key=page_key, label_visibility="collapsed")
+    with c_next:
+        st.button("Next ▶", key=f"{grid}_next", on_click=_step_page, args=(page_key, 1, pages),
+                  disabled=st.session_state[page_key] >= pages)
+    with c_size:
+        st.selectbox("Per page", PAGE_SIZES, key=size_key, label_visibility="collapsed",
+                     on_change=show_first_page, args=(grid,))
+    start = (st.session_state[page_key] - 1) * page_size
+    with c_info:
+        st.caption(f"Page {st.session_state[page_key]} of {pages} · showing {start + 1}–{min(start + page_size, len(items))} of {len(items)}")
+    return items[start:start + page_size]
+
+def find_similar(target_url, source_list=None, k=None):
     """
     Re-ranks lists based on similarity to target_url.
     If source_list is provided, only ranks images in that list.
-    Returns the sorted list.
+    If k is provided, only the k best are returned.
+    Returns the sorted list of (url, score) pairs.
     """
-    if target_url not in st.session_state.embeddings:
+    index = st.session_state.embeddings
+    if target_url not in index:
         st.warning("Embedding not found for this image.")
         return []
 
-    target_emb = st.session_state.embeddings[target_url]
-    
-    # Calculate similarity with ALL other known embeddings
-    # Optimally, we should only compare against source_list if provided, but for now filtering after is fine or we can slice embeddings.
-    # To keep it simple and correct:
-    
-    if source_list is None:
-        source_list = list(st.session_state.embeddings.keys())
-        
-    # Filter source_list to only those that have embeddings
-    valid_source = [u for u in source_list if u in st.session_state.embeddings]
-    
-    if not valid_source:
+    # Rows are already normalized, so this is one matrix-vector product plus a partial sort
+    sorted_pairs = index.search(target_url, k=k, candidates=source_list)
+
+    if not sorted_pairs:
         st.warning("No images to compare against.")
         return []
 
-    embs = np.array([st.session_state.embeddings[u] for u in valid_source])
-    
-    sims = processor.calculate_similarity(target_emb, embs)
-    
-    # Sort urls by similarity
-    # zip, sort, unzip
-    sorted_pairs = sorted(zip(valid_source, sims), key=lambda x: x[1], reverse=True)
-    # Return pairs (url, score)
     return sorted_pairs
 
+def rank_by_basket(source_list, mode="centroid", negative_weight=1.0):
+    """
+    Re-ranks source_list by the "vibe" of everything in the basket.
+    In "contrast" mode, images marked "not this" count against a candidate.
+    All basket embeddings are scored against all candidates in one batched pass.
+    Returns the sorted list of (url, score) pairs.
+    """
+    index = st.session_state.embeddings
+    negatives = [u for u in st.session_state.negatives if u in index]
+    basket = [u for u in st.session_state.basket if u in index and u not in st.session_state.negatives]
+    if not basket:
+        st.warning("Add some analyzed images to the basket first.")
+        return []
+    if mode == "contrast" and not negatives:
+        st.info("No images marked \"not this\": ranking by the closest basket image only.")
+
+    sorted_pairs = index.search_examples(basket, negatives, mode=mode, negative_weight=negative_weight,
+                                         candidates=source_list)
+    if not sorted_pairs:
+        st.warning("No images to compare against.")
+    return sorted_pairs
+
+def rank_by_prompts(prompts, source_list):
+    """
+    Scores source_list against one or more text prompts.
+    Prompts are encoded in one batch (memoized per string) and scored with one matrix product.
+    Returns one sorted list of (url, score) pairs per prompt.
+    """
+    text_embs = processor.encode_texts(prompts)
+    return st.session_state.embeddings.search_vectors(text_embs, candidates=source_list)
+
+def item_caption(key):
+    """
+    Export caption for a basket item: the site's own caption when the scrape got one,
+    else the query that found it. Fixed when the item is scraped, so re-exports don't
+    relabel it with whatever is in the prompt box now. Local imports have none.
+    """
+    meta = st.session_state.image_meta.get(key)
+    if meta is None:
+        return ""
+    return meta.caption or meta.query or ""
+
+def export_source(key):
+    """
+    File bytes of a basket item for the exporter, read only when it gets to the item.
+    A download the disk cache has evicted since the export's prefetch is fetched again.
+    """
+    data = st.session_state.images_cache.get_bytes(key, admit=False)
+    if data is None and not key.startswith("local::"):
+        _, data = sessions.run(fetch_image_bytes(sessions.session, key, http_cache, sessions.limiter))
+    return data
+
+def show_sync_result(result, export_dir):
+    """
+    Reports an incremental export: only new basket items are written, deselected ones removed.
+    """
+    st.success(f"{export_dir}: {result.added} added, {result.removed} removed, {result.kept} unchanged")
+    if result.failed:
+        st.warning(f"{result.failed} images could not be read and were left out.")
+
+# --- Main Gallery header (before the sidebar, so analysis can preview into the page) ---
+st.title("Dataset Curator")
+# Filled by download_and_embed while it runs, empty otherwise
+live_grid = st.empty()
+
 # --- Sidebar ---
 with st.sidebar:
     st.title("Search")
     
-    scraper_choice = st.selectbox("Source", ["Tumblr", "Pinterest", "Google"])
+    scraper_choices = st.multiselect("Sources", ["Tumblr", "Pinterest", "Google"], default=["Tumblr"])
     search_query = st.text_input("Prompt", "cyberpunk city aesthetic")
-    limit = st.slider("Max Results", 10, 100, 50)
+    query_variants = st.text_area("Extra query variants (one per line)", "", help="Scraped together with the prompt and merged.")
+    limit = st.slider("Max Results (per source and query)", 10, 100, 50)
+    fast_scrape = st.toggle(
+        "Fast scrape", value=False,
+        help="Tumblr/Pinterest: read the sites' own JSON feeds instead of rendering the page. Faster, and gets full-size images with captions."
+    )
     
     if st.button("Scrape", type="primary"):
-        with st.spinner(f"Scraping {scraper_choice}..."):
-            if scraper_choice == "Tumblr":
-                scraper = TumblrScraper(limit=limit)
-            elif scraper_choice == "Google":
-                scraper = GoogleScraper(limit=limit)
-            elif scraper_choice == "Pinterest":
-                scraper = PinterestScraper(limit=limit)
-                
-            urls = scraper.search(search_query)
+        scraper_classes = {"Tumblr": TumblrScraper, "Google": GoogleScraper, "Pinterest": PinterestScraper}
+        scrapers = []
+        for c in scraper_choices:
+            cls = scraper_classes[c]
+            mode = "network" if fast_scrape and cls.feed_url_patterns else "dom"
+            scrapers.append(cls(limit=limit, mode=mode))
+        queries = [search_query] + [q.strip() for q in query_variants.splitlines() if q.strip()]
+
+        with st.spinner(f"Scraping {', '.join(scraper_choices)}..."):
+            if len(scrapers) == 1 and len(queries) == 1:
+                # Single search: reuse the warm pooled browser
+                urls = scrapers[0].search(search_query)
+            else:
+                # Fan out: all sources and queries at once on the pool's warm browser, merged and deduplicated
+                urls = search_all_pooled(scrapers, queries)
             
+            for scraper in scrapers:
+                st.session_state.image_meta.update(scraper.metadata)
+
+            # Sizes the site reported let us drop out-of-range images before downloading them
+            meta = st.session_state.image_meta
+            sized = [u for u in urls if u in meta and meta[u].width and meta[u].height]
+            out_of_range = {u for u in sized if DEFAULT_LIMITS.check_dimensions(meta[u].width, meta[u].height)}
+            if out_of_range:
+                urls = [u for u in urls if u not in out_of_range]
+                st.info(f"Skipped {len(out_of_range)} images outside the allowed size range.")
+
             if urls:
                 st.session_state.scraped_urls = urls
+                st.session_state.scraped_sim_scores = {}
+                show_first_page("scraped")
                 st.success(f"Found {len(urls)} images.")
             else:
                 st.error("No images found.")
+
+    if st.button("🔎 Rank by Prompt"):
+        local_images = st.session_state.get("local_images", [])
+        all_urls = st.session_state.scraped_urls + local_images
+        if not all_urls:
+            st.error("Nothing to rank yet.")
+        else:
+            count = download_and_embed(all_urls)
+            scores = dict(rank_by_prompts([search_query], all_urls)[0])
+            # Same ordering rule as the other rankers: scored first, the rest keep their order
+            for list_key, scores_key in [("scraped_urls", "scraped_sim_scores"), ("local_images", "local_sim_scores")]:
+                current = st.session_state.get(list_key, [])
+                ranked = sorted((u for u in current if u in scores), key=lambda u: scores[u], reverse=True)
+                st.session_state[list_key] = ranked + [u for u in current if u not in scores]
+                st.session_state[scores_key] = {u: scores[u] for u in ranked}
+            show_first_page("scraped")
+            show_first_page("local")
+            st.session_state.analysis_done_count = count
+            st.rerun()
+
+    with st.expander("Prompt Filter"):
+        filter_prompts = st.text_area("Prompts (one per line)", "", help="Keeps scraped images that match any of these prompts.")
+        filter_threshold = st.slider("Min. match score", 0.0, 0.5, 0.25, 0.01)
+        if st.button("Filter Scraped Images"):
+            prompts = [p.strip() for p in filter_prompts.splitlines() if p.strip()]
+            if not prompts or not st.session_state.scraped_urls:
+                st.error("Need prompts and scraped images to filter.")
+            else:
+                download_and_embed(st.session_state.scraped_urls)
+                best = {}
+                for ranking in rank_by_prompts(prompts, st.session_state.scraped_urls):
+                    for u, score in ranking:
+                        best[u] = max(score, best.get(u, score))
+                kept = sorted((u for u, score in best.items() if score >= filter_threshold), key=lambda u: best[u], reverse=True)
+                st.session_state.scraped_urls = kept
+                st.session_state.scraped_sim_scores = {u: best[u] for u in kept}
+                show_first_page("scraped")
+                st.success(f"Kept {len(kept)} of {len(best)} images.")
                 
     st.divider()
     
+    with st.expander("Similarity Search"):
+        st.session_state.embeddings.nprobe = st.slider(
+            "Search accuracy", 1, 64, 10,
+            help="Clusters scanned per query once the collection is large enough for approximate search. Higher is more exact but slower."
+        )
+        basket_mode = st.selectbox(
+            "Rank by Basket using", ["centroid", "max", "contrast"],
+            format_func=lambda m: {"centroid": "Average of basket", "max": "Closest basket image",
+                                   "contrast": "Closest basket image, minus \"not this\""}[m]
+        )
+        negative_weight = st.slider(
+            "\"Not this\" weight", 0.0, 2.0, 1.0, 0.1, disabled=basket_mode != "contrast",
+            help="How hard images close to a \"not this\" example are pushed down."
+        )
+        st.caption(f"{len(st.session_state.negatives)} images marked \"not this\"")
+        if st.button("Clear \"not this\"", disabled=not st.session_state.negatives):
+            st.session_state.negatives = set()
+            reset_checkboxes()
+            st.rerun()
+
+    st.divider()
+
     st.subheader("Basket")
     st.caption(f"{len(st.session_state.basket)} images selected")
     
     # Basket Options
     zip_name = st.text_input("Zip Filename", "dataset")
+    # Parquet needs the optional pyarrow, only offer it when it's installed
+    export_layouts = ["Images + captions", "WebDataset shards"] + (["Parquet"] if parquet_available() else [])
+    export_layout = st.selectbox("Export as", export_layouts,
+                                 help="WebDataset: tar shards of image/.txt/.json(/.npy) samples. Parquet (needs pyarrow): one table with image bytes, captions, urls and embeddings.")
+    export_dir = st.text_input("Or export to folder on server", "", help="Writes the files there instead of offering a download. Exporting to the same folder again only adds new basket items and removes deselected ones. Required for WebDataset shards.")
     include_prompts = st.toggle("Include Prompt Text Files", value=True)
+    keep_originals = st.toggle("Keep original files", value=True, help="Export JPEG/PNG/WebP files byte-for-byte when no size or format is set. Off: re-encode everything.")
+    with st.expander("Export options"):
+        target_size = st.selectbox("Target size", [None, 512, 768, 1024, 1536, 2048],
+                                   format_func=lambda s: "Original" if s is None else f"{s}px")
+        crop = st.selectbox("Crop", ["none", "center", "bucket"],
+                            format_func={"none": "None (fit inside)", "center": "Center square", "bucket": "Aspect ratio buckets"}.get)
+        export_format = st.selectbox("Format", [None, "JPEG", "PNG", "WEBP"],
+                                     format_func=lambda f: "Keep source" if f is None else f)
+        quality = st.slider("Quality", 50, 100, 95, help="JPEG/WebP only.")
+    export_options = ExportOptions(target_size=target_size, crop=crop, format=export_format,
+                                   quality=quality, passthrough=keep_originals)
     
     if st.button("Clear Basket"):
         st.session_state.basket = set()
+        reset_checkboxes()
         st.rerun()
 
     if st.button("💾 Export Dataset"):
         if not st.session_state.basket:
             st.error("Basket is empty!")
         else:
-            # Need to ensure all basket images are downloaded
-            urls_to_download = [u for u in st.session_state.basket if u not in st.session_state.images_cache]
+            # Make sure every basket image is on disk, as the original file bytes: nothing
+            # is decoded or held in memory here (cached ones are answered without a request)
+            cache = st.session_state.images_cache
+            urls_to_download = [u for u in st.session_state.basket if u not in cache and not u.startswith("local::")]
+            failures = {}
             if urls_to_download:
-                import aiohttp
-                asyncio.run(download_and_embed(list(st.session_state.basket)))
-                
-            # Prepare data
-            images_map = {generate_filename(i, "img"): st.session_state.images_cache[u] for i, u in enumerate(st.session_state.basket) if u in st.session_state.images_cache}
-            captions_map = {k: search_query for k in images_map.keys()} # Simple caption
-            
-            # Pass new options to create_dataset_zip
-            zip_io = create_dataset_zip(images_map, captions_map, include_captions=include_prompts)
-            
-            # Ensure filename has .zip extension
-            if not zip_name.endswith(".zip"):
-                download_filename = f"{zip_name}.zip"
-            else:
-                download_filename = zip_name
+                with st.spinner(f"Downloading {len(urls_to_download)} images..."):
+                    failures = sessions.run(prefetch_images(urls_to_download, http_cache,
+                                                            session=sessions.session, limiter=sessions.limiter))
+                if failures:
+                    reasons = {}
+                    for failure in failures.values():
+                        reasons[failure.reason] = reasons.get(failure.reason, 0) + 1
+                    summary = ", ".join(f"{n}× {reason}" for reason, n in reasons.items())
+                    st.warning(f"{len(failures)} images could not be downloaded and are left out ({summary}).")
 
-            st.download_button(
-                label="Download Zip",
-                data=zip_io,
-                file_name=download_filename,
-                mime="application/zip"
+            # Lazy entries: each image is read from the cache only when the exporter gets to it
+            export_urls = [u for u in st.session_state.basket
+                           if u in cache or (not u.startswith("local::") and u not in failures)]
+            index = st.session_state.embeddings
+            meta = st.session_state.image_meta
+            entries = (
+                ExportEntry(generate_filename(i, "img"), lambda u=u: export_source(u),
+                            item_caption(u),
+                            url=None if u.startswith("local::") else u, embedding=index.get(u), key=u,
+                            source_size=(meta[u].width, meta[u].height) if u in meta and meta[u].width else None)
+                for i, u in enumerate(export_urls)
             )
 
-# --- Main Gallery ---
-st.title("Dataset Curator")
+            executor = get_export_executor() if export_options.converts or not keep_originals else None
+
+            if export_layout == "WebDataset shards":
+                if not export_dir:
+                    st.error("WebDataset shards are written to a folder, enter one above.")
+                else:
+                    with st.spinner(f"Updating shards in {export_dir}..."):
+                        result = sync_webdataset(entries, export_dir, include_captions=include_prompts,
+                                                 options=export_options, executor=executor)
+                    show_sync_result(result, export_dir)
+            elif export_layout == "Parquet":
+                parquet_name = zip_name.rsplit(".", 1)[0] + ".parquet"
+                try:
+                    if export_dir:
+                        os.makedirs(export_dir, exist_ok=True)
+                        with st.spinner(f"Writing {len(export_urls)} images to {parquet_name}..."):
+                            written = write_parquet(entries, os.path.join(export_dir, parquet_name),
+                                                    options=export_options, executor=executor)
+                        st.success(f"Exported {written} images to {os.path.join(export_dir, parquet_name)}")
+                    else:
+                        with tempfile.NamedTemporaryFile(suffix=".parquet", delete=False) as tmp:
+                            parquet_path = tmp.name
+                        try:
+                            with st.spinner(f"Packing {len(export_urls)} images..."):
+                                write_parquet(entries, parquet_path, options=export_options, executor=executor)
+                            with open(parquet_path, "rb") as parquet_file:
+                                st.download_button(label="Download Parquet", data=parquet_file,
+                                                   file_name=parquet_name, mime="application/vnd.apache.parquet")
+                        finally:
+                            os.remove(parquet_path)
+                except ImportError as e:
+                    st.error(str(e))
+            elif export_dir:
+                with st.spinner(f"Updating {export_dir}..."):
+                    result = sync_dataset_dir(entries, export_dir, include_captions=include_prompts,
+                                              options=export_options, executor=executor)
+                show_sync_result(result, export_dir)
+            else:
+                # Ensure filename has .zip extension
+                if not zip_name.endswith(".zip"):
+                    download_filename = f"{zip_name}.zip"
+                else:
+                    download_filename = zip_name
 
+                # Built on disk, not in memory; the download button then holds the only in-memory copy
+                with tempfile.NamedTemporaryFile(suffix=".zip", delete=False) as tmp:
+                    zip_path = tmp.name
+                try:
+                    with st.spinner(f"Packing {len(export_urls)} images..."):
+                        write_dataset_zip(entries, zip_path, include_captions=include_prompts,
+                                          options=export_options, executor=executor)
+                    with open(zip_path, "rb") as zip_file:
+                        st.download_button(
+                            label="Download Zip",
+                            data=zip_file,
+                            file_name=download_filename,
+                            mime="application/zip"
+                        )
+                finally:
+                    os.remove(zip_path)
+
+# --- Main Gallery ---
 # Tabs for Mode Selection
 tab_scraper, tab_local = st.tabs(["Web Scraper", "Local Import"])
 
 # --- TAB 1: Web Scraper ---
+if "scraped_sim_scores" not in st.session_state:
+    st.session_state.scraped_sim_scores = {} # url -> score
+
 with tab_scraper:
     if not st.session_state.scraped_urls:
         st.info("Start by scraping some images from the sidebar.")
@@ -247,10 +605,22 @@ with tab_scraper:
         with col1:
             if st.button("Select All Scraped URLs"):
                 st.session_state.basket.update(st.session_state.scraped_urls)
+                reset_checkboxes()
                 st.rerun()
         with col2:
-             # Placeholder for alignment if needed, or just remove col2
-             pass
+             if st.button("✨ Rank by Basket"):
+                 # Basket may hold local images too, make sure everything involved is embedded
+                 count = download_and_embed(st.session_state.scraped_urls + list(st.session_state.basket)
+                                            + list(st.session_state.negatives))
+                 sorted_pairs = rank_by_basket(st.session_state.scraped_urls, mode=basket_mode,
+                                               negative_weight=negative_weight)
+                 if sorted_pairs:
+                     st.session_state.scraped_sim_scores = {u: s for u, s in sorted_pairs}
+                     ranked = [u for u, s in sorted_pairs]
+                     st.session_state.scraped_urls = ranked + [u for u in st.session_state.scraped_urls if u not in st.session_state.scraped_sim_scores]
+                     show_first_page("scraped")
+                     st.session_state.analysis_done_count = count
+                     st.rerun()
 
         if "analysis_done_count" in st.session_state:
             count = st.session_state.pop("analysis_done_count")
@@ -259,29 +629,49 @@ with tab_scraper:
             else:
                 st.info("Analysis complete. No new images needed analysis.")
 
-        # Grid for Scraped Images
+        # Grid for Scraped Images, one page at a time
+        page_urls = paginate(st.session_state.scraped_urls, "scraped")
+        thumbs = grid_thumbnails(page_urls)
         cols = st.columns(4)
-        for i, url in enumerate(st.session_state.scraped_urls):
+        for i, url in enumerate(page_urls):
             col = cols[i % 4]
             with col:
-                is_selected = url in st.session_state.basket
                 
                 with st.container(border=True):
-                    if url in st.session_state.images_cache:
-                        st.image(st.session_state.images_cache[url], use_container_width=True)
+                    caption_text = None
+                    if url in st.session_state.scraped_sim_scores:
+                        caption_text = f"Sim: {st.session_state.scraped_sim_scores[url]:.4f}"
+
+                    if thumbs.get(url) is not None:
+                        st.image(thumbs[url], use_container_width=True, caption=caption_text)
                     else:
-                        st.image(url, use_container_width=True)
+                        # We couldn't fetch it, maybe the browser can
+                        st.image(url, use_container_width=True, caption=caption_text)
                     
                     # Controls
                     # Just Selection, no Similar button as requested
-                    if st.checkbox("Select", label_visibility="collapsed", value=is_selected, key=f"sel_{i}"):
-                        st.session_state.basket.add(url)
-                    else:
-                        st.session_state.basket.discard(url)
+                    # Keyed by url so the checkbox follows its image when the grid is re-ranked.
+                    # Cells off the current page drop their widget state; the basket re-seeds it.
+                    c_sel, c_neg = st.columns(2)
+                    with c_sel:
+                        if f"sel_{url}" not in st.session_state:
+                            st.session_state[f"sel_{url}"] = url in st.session_state.basket
+                        if st.checkbox("Select", label_visibility="collapsed", key=f"sel_{url}"):
+                            st.session_state.basket.add(url)
+                        else:
+                            st.session_state.basket.discard(url)
+                    with c_neg:
+                        # Counter-example for "contrast" ranking
+                        if f"neg_{url}" not in st.session_state:
+                            st.session_state[f"neg_{url}"] = url in st.session_state.negatives
+                        if st.checkbox("👎 Not this", key=f"neg_{url}"):
+                            st.session_state.negatives.add(url)
+                        else:
+                            st.session_state.negatives.discard(url)
 
 # --- TAB 2: Local Import ---
 if "local_images" not in st.session_state:
-    st.session_state.local_images = [] # List of unique IDs (local::{filename}::{uuid})
+    st.session_state.local_images = [] # List of unique IDs (local::{filename}::{content hash})
 if "local_sim_scores" not in st.session_state:
     st.session_state.local_sim_scores = {} # uid -> score
 if "uploader_key" not in st.session_state:
@@ -297,63 +687,62 @@ with tab_local:
         key=f"uploader_{st.session_state.uploader_key}"
     )
     
-    if uploaded_files:
-        import zipfile
-        import uuid
-        
-        new_files_count = 0
-        for uploaded_file in uploaded_files:
-            # Check file type
-            if uploaded_file.name.lower().endswith(".zip"):
-                 # Handle Zip
-                 try:
-                     with zipfile.ZipFile(uploaded_file) as z:
-                         for filename in z.namelist():
-                             # Simple filter for images
-                             if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')):
-                                 with z.open(filename) as f:
-                                     # Load image bytes
-                                     img_bytes = f.read()
-                                     image = Image.open(io.BytesIO(img_bytes))
-                                     
-                                     # Unique ID to allow duplicate filenames from diff folders
-                                     # Use prefix local::{filename}::{uuid}
-                                     unique_start = f"local::{filename}::{uuid.uuid4()}"
-                                     
-                                     st.session_state.images_cache[unique_start] = image
-                                     st.session_state.local_images.append(unique_start)
-                                     new_files_count += 1
-                 except Exception as e:
-                     st.error(f"Error processing zip {uploaded_file.name}: {e}")
-            else:
-                # Handle Image
-                # Unique ID
-                file_id = f"local::{uploaded_file.name}::{uuid.uuid4()}"
-                
-                try:
-                    image = Image.open(uploaded_file)
-                    st.session_state.images_cache[file_id] = image
-                    st.session_state.local_images.append(file_id)
-                    new_files_count += 1
-                except Exception as e:
-                    st.error(f"Error loading {uploaded_file.name}: {e}")
-        
-        if new_files_count > 0:
-            st.success(f"Imported {new_files_count} images.")
-            # Reset uploader for addictive workflow
-            st.session_state.uploader_key += 1
-            st.rerun()
+    sources = []
+    for uploaded_file in uploaded_files or []:
+        if uploaded_file.name.lower().endswith(".zip"):
+            sources.append((uploaded_file.name, lambda f=uploaded_file: zip_members(f)))
+        else:
+            sources.append((uploaded_file.name, lambda f=uploaded_file: (1, iter([(f.name, f.getvalue)]))))
+
+    if sources:
+        imported, duplicates, failed = 0, 0, []
+        known = known_local_hashes(st.session_state.local_images)
+        progress = st.progress(0.0, text="Importing...")
+        for source_name, open_source in sources:
+            try:
+                total, members = open_source()
+            except Exception as e:
+                st.error(f"Error opening {source_name}: {e}")
+                continue
+            # Streamed: files are read, checked and thumbnailed a few at a time on worker threads
+            for done, result in enumerate(import_images(members, known_hashes=known, thumb_size=THUMBNAIL_SIZE), 1):
+                if result.ok:
+                    st.session_state.images_cache.put_bytes(result.id, result.data)
+                    if result.thumbnail is not None:
+                        thumbnails.put(result.id, result.thumbnail)
+                    st.session_state.local_images.append(result.id)
+                    known.append(result.digest)
+                    imported += 1
+                elif result.duplicate:
+                    duplicates += 1
+                else:
+                    failed.append(f"{result.name}: {result.error}")
+                if done % 16 == 0 or done == total:
+                    progress.progress(min(done / max(total, 1), 1.0), text=f"{source_name}: {done}/{total} files")
+        progress.empty()
+
+        summary = f"Imported {imported} images" + (f", skipped {duplicates} duplicates." if duplicates else ".")
+        st.session_state.import_summary = (summary, failed)
+        # Reset uploader for addictive workflow
+        st.session_state.uploader_key += 1
+        st.rerun()
+
+    if "import_summary" in st.session_state:
+        summary, failed = st.session_state.pop("import_summary")
+        st.success(summary)
+        if failed:
+            st.warning(f"Skipped {len(failed)} unreadable files:\n" + "\n".join(failed[:10]))
     
     # Clear Button
     if st.button("Clear Local Images"):
         # Remove local images from cache to free memory? Or just clear list?
         # Better to clear cache too for local items
         for uid in st.session_state.local_images:
-            if uid in st.session_state.images_cache:
-                del st.session_state.images_cache[uid]
-            if uid in st.session_state.embeddings:
-                del st.session_state.embeddings[uid]
+            st.session_state.images_cache.discard(uid)
+            thumbnails.discard(uid)
                 
+        st.session_state.embeddings.remove(st.session_state.local_images)
+        st.session_state.negatives.difference_update(st.session_state.local_images)
         st.session_state.local_images = []
         st.session_state.local_sim_scores = {}
         st.rerun()
@@ -366,23 +755,34 @@ with tab_local:
         with l_col1:
              if st.button("Select All Local Images"):
                 st.session_state.basket.update(st.session_state.local_images)
+                reset_checkboxes()
                 st.rerun()
         with l_col2:
-             # Removed Analyze button
-             pass
+             if st.button("✨ Rank by Basket", key="l_rank_basket"):
+                 download_and_embed(st.session_state.local_images + list(st.session_state.basket)
+                                    + list(st.session_state.negatives))
+                 sorted_pairs = rank_by_basket(st.session_state.local_images, mode=basket_mode,
+                                               negative_weight=negative_weight)
+                 if sorted_pairs:
+                     st.session_state.local_sim_scores = {u: s for u, s in sorted_pairs}
+                     ranked = [u for u, s in sorted_pairs]
+                     st.session_state.local_images = ranked + [u for u in st.session_state.local_images if u not in st.session_state.local_sim_scores]
+                     show_first_page("local")
+                     st.rerun()
 
-        # Grid for Local Images
+        # Grid for Local Images, one page at a time
+        page_uids = paginate(st.session_state.local_images, "local")
+        l_thumbs = grid_thumbnails(page_uids)
         l_cols = st.columns(4)
-        for i, uid in enumerate(st.session_state.local_images):
+        for i, uid in enumerate(page_uids):
             col = l_cols[i % 4]
             with col:
-                is_selected = uid in st.session_state.basket
                 
                 with st.container(border=True):
                     # Caption: filename + score if available
-                    # Format: local::{filename}::{uuid}
+                    # Format: local::{filename}::{content hash}
                     parts = uid.split("::")
-                    # parts[0] is 'local', parts[1] is filename, parts[2] is uuid
+                    # parts[0] is 'local', parts[1] is filename, parts[2] is the content hash
                     if len(parts) >= 2:
                         caption_text = parts[1]
                     else:
@@ -392,31 +792,45 @@ with tab_local:
                         score = st.session_state.local_sim_scores[uid]
                         caption_text += f"\nSim: {score:.4f}"
                     
-                    # Show image from cache
-                    st.image(st.session_state.images_cache[uid], use_container_width=True, caption=caption_text)
+                    # Show the preview, full-res is only decoded for export
+                    if l_thumbs.get(uid) is not None:
+                        st.image(l_thumbs[uid], use_container_width=True, caption=caption_text)
+                    else:
+                        st.caption(f"⚠️ Unreadable image\n{caption_text}")
                     
                     # Controls
-                    lc1, lc2 = st.columns([1, 3])
+                    lc1, lc_neg, lc2 = st.columns([1, 1, 2])
                     with lc1:
-                        if st.checkbox("Select", label_visibility="collapsed", value=is_selected, key=f"l_sel_{i}"):
+                        if f"l_sel_{uid}" not in st.session_state:
+                            st.session_state[f"l_sel_{uid}"] = uid in st.session_state.basket
+                        if st.checkbox("Select", label_visibility="collapsed", key=f"l_sel_{uid}"):
                             st.session_state.basket.add(uid)
                         else:
                             st.session_state.basket.discard(uid)
+                    with lc_neg:
+                        if f"l_neg_{uid}" not in st.session_state:
+                            st.session_state[f"l_neg_{uid}"] = uid in st.session_state.negatives
+                        if st.checkbox("👎", key=f"l_neg_{uid}", help="Not this: counts against similar images in contrast ranking"):
+                            st.session_state.negatives.add(uid)
+                        else:
+                            st.session_state.negatives.discard(uid)
                     
                     with lc2:
-                        if st.button("🔍 Similar", key=f"l_sim_{i}"):
+                        if st.button("🔍 Similar", key=f"l_sim_{uid}"):
                             # 1. Ensure ALL local images are embedded first to prevent "vanishing"
                             # This is fast for local images (no network)
-                            import aiohttp
-                            asyncio.run(download_and_embed(st.session_state.local_images))
+                            download_and_embed(st.session_state.local_images)
                                  
                             if uid in st.session_state.embeddings:
-                                sorted_pairs = find_similar(uid, st.session_state.local_images)
+                                sorted_pairs = find_similar(uid, st.session_state.local_images,
+                                                            k=SIMILAR_TOP_K if st.session_state.embeddings.trained else None)
                                 if sorted_pairs:
-                                    # Update listing order
-                                    st.session_state.local_images = [u for u, s in sorted_pairs]
                                     # Store scores for display
                                     st.session_state.local_sim_scores = {u: s for u, s in sorted_pairs}
+                                    # Update listing order: ranked images first, unranked ones keep their order
+                                    ranked = [u for u, s in sorted_pairs]
+                                    st.session_state.local_images = ranked + [u for u in st.session_state.local_images if u not in st.session_state.local_sim_scores]
+                                    show_first_page("local")
                                     st.rerun()
                             else:
                                 st.error("Failed to process image.")
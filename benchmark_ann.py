@@ -0,0 +1,72 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# Ensure src is in path
+sys.path.append(os.getcwd())
+
+from src.ai.index import EmbeddingIndex
+from src.ai.ann import IVFIndex
+
+
+def make_embeddings(n, dim, n_clusters, seed=0):
+    """
+    Synthetic CLIP-like data: unit vectors scattered around a few hundred "topics".
+    Uniform random vectors would make every method look equally bad.
+    """
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, n_clusters, n)
+    x = topics[labels] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    return EmbeddingIndex.normalize(x)
+
+
+def time_queries(index, queries, k):
+    results = []
+    start = time.perf_counter()
+    for q in queries:
+        results.append([u for u, _ in index.search_vector(q, k=k)])
+    elapsed = (time.perf_counter() - start) / len(queries)
+    return elapsed, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare exact and IVF search latency/recall.")
+    parser.add_argument("--n", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"Generating {args.n} x {args.dim} embeddings...")
+    x = make_embeddings(args.n, args.dim, n_clusters=300)
+    urls = [f"img_{i}" for i in range(args.n)]
+    queries = make_embeddings(args.queries, args.dim, n_clusters=300, seed=1)
+
+    exact = EmbeddingIndex()
+    exact.add_many(urls, x)
+
+    ivf = IVFIndex(train_threshold=1, background=False)
+    start = time.perf_counter()
+    # Add in chunks, the way download_and_embed feeds the index
+    for s in range(0, args.n, 10000):
+        ivf.add_many(urls[s:s + 10000], x[s:s + 10000])
+    ivf.train()
+    print(f"IVF build: {time.perf_counter() - start:.2f}s ({len(ivf.centroids)} lists)")
+
+    exact_time, truth = time_queries(exact, queries, args.k)
+    print(f"\n{'method':<16}{'ms/query':>10}{'recall@' + str(args.k):>12}")
+    print(f"{'exact':<16}{exact_time * 1000:>10.2f}{1.0:>12.3f}")
+
+    for nprobe in [1, 2, 5, 10, 20, 50]:
+        ivf.nprobe = nprobe
+        ivf_time, found = time_queries(ivf, queries, args.k)
+        recall = np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)])
+        print(f"{'ivf nprobe=' + str(nprobe):<16}{ivf_time * 1000:>10.2f}{recall:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -31,9 +31,11 @@ def test_scrape():
 
 async def test_download(urls):
     print("\nDownloading...")
-    results = await download_images_parallel(urls)
-    print(f"Downloaded {len(results)} images")
-    return results
+    report = await download_images_parallel(urls)
+    print(f"Downloaded {len(report.images)} images")
+    for failure in report.failures.values():
+        print(f"  failed after {failure.attempts} attempt(s): {failure.reason} - {failure.url}")
+    return report.images
 
 if __name__ == "__main__":
     urls = test_scrape()
@@ -0,0 +1,223 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .index import EmbeddingIndex, top_k
+
+
+def spherical_kmeans(x: np.ndarray, n_clusters: int, iters: int = 10, seed: int = 0,
+                     block: int = 4096) -> np.ndarray:
+    """
+    K-means on the unit sphere (cosine distance). x must be L2-normalized.
+    Returns normalized centroids of shape (n_clusters, dim).
+    """
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(x.shape[0], n_clusters, replace=False)].astype(np.float32)
+    for _ in range(iters):
+        assign = assign_nearest(x, centroids, block=block)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=n_clusters)
+        nonempty = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+        sums = np.add.reduceat(x[order], starts, axis=0)
+
+        updated = centroids.copy()
+        updated[nonempty] = sums
+        # Re-seed empty clusters on random points so every list stays useful
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            updated[empty] = x[rng.choice(x.shape[0], len(empty), replace=False)]
+        centroids = EmbeddingIndex.normalize(updated)
+    return centroids
+
+
+def assign_nearest(x: np.ndarray, centroids: np.ndarray, block: int = 4096) -> np.ndarray:
+    """
+    Index of the most similar centroid for every row, computed in blocks to bound memory.
+    """
+    out = np.empty(x.shape[0], dtype=np.int64)
+    for start in range(0, x.shape[0], block):
+        chunk = x[start:start + block].astype(np.float32)
+        out[start:start + block] = np.argmax(chunk.dot(centroids.T), axis=1)
+    return out
+
+
+class IVFIndex(EmbeddingIndex):
+    """
+    Approximate nearest-neighbour index (IVF-flat) on top of EmbeddingIndex.
+
+    Below `train_threshold` rows it is exactly EmbeddingIndex (brute force).
+    Once enough rows arrive, rows are clustered into `nlist` inverted lists with
+    spherical k-means; new rows are appended to their nearest list as they are added,
+    and the clustering is rebuilt whenever the index grows by `retrain_factor`.
+    With background=True (the default) k-means runs on a worker thread so adding rows
+    never blocks on it; until it finishes, queries keep using the previous clustering
+    (or brute force), and the new one is swapped in by the next add/remove/search.
+
+    A query only scores rows in the `nprobe` lists closest to it.
+    nprobe is the recall/latency knob: higher means closer to exact, but slower.
+    Full rankings (k=None) always use the exact path.
+    """
+
+    def __init__(self, dim: Optional[int] = None, dtype=np.float32, nprobe: int = 10,
+                 nlist: Optional[int] = None, train_threshold: int = 20000,
+                 retrain_factor: float = 4.0, kmeans_iters: int = 10, seed: int = 0,
+                 background: bool = True):
+        super().__init__(dim=dim, dtype=dtype)
+        self.nprobe = nprobe
+        self.nlist = nlist
+        self.train_threshold = train_threshold
+        self.retrain_factor = retrain_factor
+        self.kmeans_iters = kmeans_iters
+        self.seed = seed
+
+        self.centroids: Optional[np.ndarray] = None
+        self._lists: List[List[int]] = []
+        self._assign = np.empty(0, dtype=np.int64)
+        self._trained_size = 0
+        self.background = background
+        self._trainer: Optional[ThreadPoolExecutor] = None
+        self._training: Optional[Future] = None
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def training(self) -> bool:
+        return self._training is not None
+
+    def _training_sample(self) -> Tuple[np.ndarray, int]:
+        n = len(self)
+        nlist = self.nlist or int(np.clip(np.sqrt(n), 16, 4096))
+        nlist = min(nlist, n)
+        # ~40 points per centroid is plenty for k-means to converge.
+        # Fancy indexing copies, so the sample is safe to use from another thread.
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(n, max(40 * nlist, 10000))
+        sample = self.matrix[np.sort(rng.choice(n, sample_size, replace=False))].astype(np.float32)
+        return sample, nlist
+
+    def train(self, background: bool = False):
+        """
+        (Re)build the clustering and inverted lists from every indexed row.
+        background=True only starts k-means on the worker thread (if it isn't running
+        already); the result is installed by a later call, see _install_pending.
+        """
+        if len(self) == 0:
+            return
+        if background:
+            if self._training is None:
+                if self._trainer is None:
+                    self._trainer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ivf-train")
+                sample, nlist = self._training_sample()
+                self._training = self._trainer.submit(spherical_kmeans, sample, nlist,
+                                                      iters=self.kmeans_iters, seed=self.seed)
+            return
+        # A synchronous train supersedes one still running in the background
+        self._training = None
+        sample, nlist = self._training_sample()
+        self._install(spherical_kmeans(sample, nlist, iters=self.kmeans_iters, seed=self.seed))
+
+    def _install_pending(self):
+        if self._training is None or not self._training.done():
+            return
+        future, self._training = self._training, None
+        if len(self) > 0:
+            self._install(future.result())
+
+    def _install(self, centroids: np.ndarray):
+        # Rows are assigned here, on the caller's thread, so adds/removes made while
+        # k-means ran are accounted for
+        n = len(self)
+        x = self.matrix
+        nlist = centroids.shape[0]
+        self.centroids = centroids
+        assign = assign_nearest(x, self.centroids)
+        self._assign = np.full(self._matrix.shape[0], -1, dtype=np.int64)
+        self._assign[:n] = assign
+        self._lists = [[] for _ in range(nlist)]
+        for row, c in enumerate(assign.tolist()):
+            self._lists[c].append(row)
+        self._trained_size = n
+
+    def clear(self):
+        super().clear()
+        self.centroids = None
+        self._lists = []
+        self._assign = np.empty(0, dtype=np.int64)
+        self._trained_size = 0
+        self._training = None
+
+    def add_many(self, urls: Sequence[str], embeddings: np.ndarray):
+        super().add_many(urls, embeddings)
+        if len(urls) == 0:
+            return
+        self._install_pending()
+        if not self.trained:
+            if len(self) >= self.train_threshold:
+                self.train(background=self.background)
+            return
+        if len(self) >= self.retrain_factor * self._trained_size:
+            self.train(background=self.background)
+            if not self.background:
+                return
+
+        if self._assign.shape[0] < self._matrix.shape[0]:
+            grown = np.full(self._matrix.shape[0], -1, dtype=np.int64)
+            grown[:self._assign.shape[0]] = self._assign
+            self._assign = grown
+
+        rows = self.rows_for(urls)
+        nearest = assign_nearest(self._matrix[rows], self.centroids)
+        for row, c in zip(rows.tolist(), nearest.tolist()):
+            old = self._assign[row]
+            if old == c:
+                continue
+            if old >= 0:
+                self._lists[old].remove(row)
+            self._lists[c].append(row)
+            self._assign[row] = c
+
+    def remove(self, urls: Iterable[str]):
+        self._install_pending()
+        if not self.trained:
+            super().remove(urls)
+            return
+        for url in urls:
+            row = self._rows.get(url)
+            if row is None:
+                continue
+            last = len(self) - 1
+            self._lists[self._assign[row]].remove(row)
+            if row != last:
+                # Mirror the swap-with-last done by EmbeddingIndex.remove
+                moved_list = self._lists[self._assign[last]]
+                moved_list[moved_list.index(last)] = row
+                self._assign[row] = self._assign[last]
+            self._assign[last] = -1
+            super().remove([url])
+
+    def search_vector(self, query: np.ndarray, k: Optional[int] = None,
+                      candidates: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        self._install_pending()
+        if not self.trained or k is None:
+            return super().search_vector(query, k=k, candidates=candidates)
+
+        query = self.normalize(query)
+        probe = top_k(self.centroids.dot(query), self.nprobe)
+        rows = np.fromiter((r for c in probe.tolist() for r in self._lists[c]), dtype=np.int64)
+
+        if candidates is not None:
+            allowed = np.zeros(len(self), dtype=bool)
+            allowed[self.rows_for(candidates)] = True
+            rows = rows[allowed[rows]]
+
+        # Too few rows in the probed lists (e.g. a narrow candidate set): answer exactly
+        if len(rows) < k:
+            return super().search_vector(query, k=k, candidates=candidates)
+
+        scores = self._scores(query, rows)
+        order = top_k(scores, k)
+        return [(self._urls[rows[i]], float(scores[i])) for i in order]
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "dataset_curator")
+
+
+def image_content_hash(image: Image.Image) -> str:
+    """
+    Hash of the decoded pixels of a PIL Image (mode + size + raw bytes).
+    Two files that decode to the same pixels get the same hash, wherever they came from.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Persistent embedding cache for one model.
+
+    Layout on disk (one directory per model):
+      vectors.f32  raw float32 rows, memory-mapped for reads
+      keys.txt     one content hash per line, line number == row number
+      meta.json    model name and embedding dimension
+
+    Rows are append-only. Vectors are written before their keys, so a crash can
+    only leave orphaned rows, which are trimmed on the next load.
+    Safe to share between threads of one process (e.g. via st.cache_resource),
+    not between processes writing at the same time.
+    """
+
+    def __init__(self, model_name: str, root: str = DEFAULT_CACHE_DIR):
+        self.model_name = model_name
+        slug = re.sub(r"[^A-Za-z0-9._-]+", "_", model_name)
+        self.path = os.path.join(root, "embeddings", slug)
+        os.makedirs(self.path, exist_ok=True)
+
+        self._vectors_path = os.path.join(self.path, "vectors.f32")
+        self._keys_path = os.path.join(self.path, "keys.txt")
+        self._meta_path = os.path.join(self.path, "meta.json")
+
+        self._lock = threading.Lock()
+        self._rows: Dict[str, int] = {}
+        self._count = 0
+        self._matrix: Optional[np.memmap] = None
+        self.dim: Optional[int] = None
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self._meta_path):
+            return
+        with open(self._meta_path) as f:
+            self.dim = int(json.load(f)["dim"])
+
+        keys: List[str] = []
+        if os.path.exists(self._keys_path):
+            with open(self._keys_path) as f:
+                keys = [line.strip() for line in f if line.strip()]
+
+        row_bytes = self.dim * 4
+        size = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+        count = min(len(keys), size // row_bytes)
+
+        # Repair a torn write: drop rows without keys and keys without rows
+        if size != count * row_bytes:
+            with open(self._vectors_path, "r+b") as f:
+                f.truncate(count * row_bytes)
+        if len(keys) > count:
+            keys = keys[:count]
+            with open(self._keys_path, "w") as f:
+                f.writelines(k + "\n" for k in keys)
+
+        self._rows = {k: i for i, k in enumerate(keys)}
+        self._count = count
+        self._remap()
+
+    def _remap(self):
+        if self._count:
+            self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(self._count, self.dim))
+        else:
+            self._matrix = None
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._rows
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        row = self._rows.get(key)
+        if row is None:
+            return None
+        return np.array(self._matrix[row])
+
+    def lookup(self, keys: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Bulk lookup.
+        Returns (hit_mask, embeddings) where embeddings holds one row per hit, in key order.
+        """
+        with self._lock:
+            rows = np.fromiter((self._rows.get(k, -1) for k in keys), dtype=np.int64, count=len(keys))
+            hits = rows >= 0
+            if not hits.any():
+                return hits, np.empty((0, self.dim or 0), dtype=np.float32)
+            # Fancy indexing a memmap copies just the requested rows
+            return hits, np.asarray(self._matrix[rows[hits]])
+
+    def put_many(self, keys: Sequence[str], embeddings: np.ndarray):
+        """
+        Append embeddings for keys that aren't stored yet.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.ndim != 2 or len(keys) != embeddings.shape[0]:
+            raise ValueError("Expected one embedding row per key.")
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = embeddings.shape[1]
+                with open(self._meta_path, "w") as f:
+                    json.dump({"model": self.model_name, "dim": self.dim}, f)
+            elif embeddings.shape[1] != self.dim:
+                raise ValueError(f"Embedding dim {embeddings.shape[1]} does not match store dim {self.dim}.")
+
+            new_keys = []
+            new_rows = []
+            seen = set()
+            for i, key in enumerate(keys):
+                if key in self._rows or key in seen:
+                    continue
+                seen.add(key)
+                new_keys.append(key)
+                new_rows.append(i)
+            if not new_keys:
+                return
+
+            with open(self._vectors_path, "ab") as f:
+                f.write(np.ascontiguousarray(embeddings[new_rows]).tobytes())
+            with open(self._keys_path, "a") as f:
+                f.writelines(k + "\n" for k in new_keys)
+
+            for key in new_keys:
+                self._rows[key] = self._count
+                self._count += 1
+            self._remap()
+
+
+def encode_with_store(processor, store: EmbeddingStore, images: List[Image.Image]) -> np.ndarray:
+    """
+    Embeddings for images, in order. Only images the store hasn't seen go through
+    processor.encode_images; their embeddings are added to the store.
+    """
+    keys = [image_content_hash(img) for img in images]
+    hits, cached = store.lookup(keys)
+    if hits.all():
+        return cached
+
+    misses = np.flatnonzero(~hits)
+    encoded = np.asarray(processor.encode_images([images[i] for i in misses]), dtype=np.float32)
+    store.put_many([keys[i] for i in misses], encoded)
+
+    out = np.empty((len(images), encoded.shape[1]), dtype=np.float32)
+    if len(cached):
+        out[hits] = cached
+    out[misses] = encoded
+    return out
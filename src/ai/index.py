@@ -0,0 +1,241 @@
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+AGGREGATIONS = ("centroid", "max", "contrast")
+
+
+def top_k(scores: np.ndarray, k: Optional[int] = None) -> np.ndarray:
+    """
+    Indices of the k highest scores, best first.
+    Uses argpartition so only the k winners get sorted.
+    """
+    n = scores.shape[0]
+    if k is None or k >= n:
+        return np.argsort(-scores, kind="stable")
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    part = np.argpartition(-scores, k - 1)[:k]
+    return part[np.argsort(-scores[part], kind="stable")]
+
+
+class EmbeddingIndex:
+    """
+    In-memory similarity index over L2-normalized embeddings.
+
+    All rows live in one contiguous matrix that grows by doubling, with a url -> row map,
+    so a query is a single matrix-vector product over a slice of it.
+    float16 storage halves memory; scores are always computed in float32.
+    """
+
+    def __init__(self, dim: Optional[int] = None, dtype=np.float32, initial_capacity: int = 1024):
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self._initial_capacity = initial_capacity
+        self._matrix: Optional[np.ndarray] = None
+        self._urls: List[str] = []
+        self._rows: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._urls)
+
+    def __contains__(self, url: str) -> bool:
+        return url in self._rows
+
+    @property
+    def urls(self) -> List[str]:
+        return list(self._urls)
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """
+        View of the live rows (normalized).
+        """
+        if self._matrix is None:
+            return np.empty((0, self.dim or 0), dtype=self.dtype)
+        return self._matrix[:len(self._urls)]
+
+    @staticmethod
+    def normalize(embeddings: np.ndarray) -> np.ndarray:
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+        # Avoid division by zero
+        norms[norms == 0] = 1
+        return embeddings / norms
+
+    def _reserve(self, n: int):
+        if self._matrix is None:
+            capacity = max(self._initial_capacity, n)
+            self._matrix = np.empty((capacity, self.dim), dtype=self.dtype)
+        elif n > self._matrix.shape[0]:
+            capacity = max(n, 2 * self._matrix.shape[0])
+            grown = np.empty((capacity, self.dim), dtype=self.dtype)
+            grown[:len(self._urls)] = self._matrix[:len(self._urls)]
+            self._matrix = grown
+
+    def add(self, url: str, embedding: np.ndarray):
+        self.add_many([url], np.asarray(embedding)[None, :])
+
+    def add_many(self, urls: Sequence[str], embeddings: np.ndarray):
+        """
+        Insert or overwrite rows. Embeddings are normalized once, here.
+        """
+        if len(urls) == 0:
+            return
+        embeddings = self.normalize(embeddings)
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+        elif embeddings.shape[1] != self.dim:
+            raise ValueError(f"Embedding dim {embeddings.shape[1]} does not match index dim {self.dim}.")
+
+        self._reserve(len(self._urls) + len(urls))
+        for url, emb in zip(urls, embeddings):
+            row = self._rows.get(url)
+            if row is None:
+                row = len(self._urls)
+                self._rows[url] = row
+                self._urls.append(url)
+            self._matrix[row] = emb
+
+    def remove(self, urls: Iterable[str]):
+        """
+        Delete rows by moving the last row into the freed slot.
+        """
+        for url in urls:
+            row = self._rows.pop(url, None)
+            if row is None:
+                continue
+            last = len(self._urls) - 1
+            if row != last:
+                moved = self._urls[last]
+                self._matrix[row] = self._matrix[last]
+                self._urls[row] = moved
+                self._rows[moved] = row
+            self._urls.pop()
+
+    def clear(self):
+        self._matrix = None
+        self._urls = []
+        self._rows = {}
+
+    def get(self, url: str) -> Optional[np.ndarray]:
+        row = self._rows.get(url)
+        if row is None:
+            return None
+        return self._matrix[row].astype(np.float32)
+
+    def rows_for(self, urls: Iterable[str]) -> np.ndarray:
+        """
+        Row ids for the urls that are indexed, in input order.
+        """
+        return np.fromiter((self._rows[u] for u in urls if u in self._rows), dtype=np.int64)
+
+    def _score_blocks(self, queries: np.ndarray, rows: Optional[np.ndarray], block: int = 65536):
+        """
+        Yield (start, end, similarities) for candidates against a (m, dim) block of queries.
+        Works in row blocks so the candidate copy doesn't grow with the collection.
+        """
+        n = len(self._urls) if rows is None else len(rows)
+        queries_t = np.ascontiguousarray(queries.T, dtype=np.float32)
+        for start in range(0, n, block):
+            end = min(start + block, n)
+            if rows is None:
+                chunk = self._matrix[start:end]
+            else:
+                chunk = self._matrix[rows[start:end]]
+            if chunk.dtype != np.float32:
+                # Reduced-precision storage is upcast one block at a time
+                chunk = chunk.astype(np.float32)
+            yield start, end, chunk.dot(queries_t)
+
+    def _reduce_scores(self, queries: np.ndarray, rows: Optional[np.ndarray], reduce) -> np.ndarray:
+        """
+        Reduce each (block, m) similarity matrix to one score per candidate.
+        """
+        n = len(self._urls) if rows is None else len(rows)
+        scores = np.empty(n, dtype=np.float32)
+        for start, end, block_scores in self._score_blocks(queries, rows):
+            scores[start:end] = reduce(block_scores)
+        return scores
+
+    def _scores(self, query: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        return self._reduce_scores(query[None, :], rows, lambda s: s[:, 0])
+
+    def _ranked(self, scores: np.ndarray, rows: Optional[np.ndarray], k: Optional[int]) -> List[Tuple[str, float]]:
+        order = top_k(scores, k)
+        if rows is not None:
+            return [(self._urls[rows[i]], float(scores[i])) for i in order]
+        return [(self._urls[i], float(scores[i])) for i in order]
+
+    def search_vector(self, query: np.ndarray, k: Optional[int] = None,
+                      candidates: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """
+        Rank indexed urls (or only `candidates`) by cosine similarity to a query vector.
+        Returns [(url, score)] best first, at most k of them.
+        """
+        if not self._urls:
+            return []
+        query = self.normalize(query)
+        rows = None if candidates is None else self.rows_for(candidates)
+        return self._ranked(self._scores(query, rows), rows, k)
+
+    def search_vectors(self, queries: np.ndarray, k: Optional[int] = None,
+                       candidates: Optional[Iterable[str]] = None) -> List[List[Tuple[str, float]]]:
+        """
+        Rank candidates against many query vectors (e.g. a list of prompts) with one
+        matrix-matrix product. Returns one [(url, score)] ranking per query.
+        """
+        queries = self.normalize(np.atleast_2d(queries))
+        if not self._urls:
+            return [[] for _ in range(queries.shape[0])]
+        rows = None if candidates is None else self.rows_for(candidates)
+        n = len(self._urls) if rows is None else len(rows)
+        # Keep the full (m, n) score matrix; m is small (a handful of prompts)
+        scores = np.empty((queries.shape[0], n), dtype=np.float32)
+        for start, end, block_scores in self._score_blocks(queries, rows):
+            scores[:, start:end] = block_scores.T
+        return [self._ranked(scores[j], rows, k) for j in range(queries.shape[0])]
+
+    def search(self, url: str, k: Optional[int] = None,
+               candidates: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """
+        Rank by similarity to an already indexed url.
+        """
+        row = self._rows.get(url)
+        if row is None:
+            return []
+        return self.search_vector(self._matrix[row].astype(np.float32), k=k, candidates=candidates)
+
+    def search_examples(self, positives: Iterable[str], negatives: Iterable[str] = (),
+                        mode: str = "centroid", negative_weight: float = 1.0, k: Optional[int] = None,
+                        candidates: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """
+        Rank by the "vibe" of a set of indexed examples, scoring every candidate in one pass.
+
+        mode:
+          "centroid" - similarity to the mean of the positives
+          "max"      - similarity to the closest positive
+          "contrast" - closest positive minus negative_weight * closest negative
+        """
+        if mode not in AGGREGATIONS:
+            raise ValueError(f"Unknown mode {mode!r}, expected one of {AGGREGATIONS}.")
+        pos = self.rows_for(positives)
+        if not len(pos):
+            return []
+        neg = self.rows_for(negatives) if mode == "contrast" else np.empty(0, dtype=np.int64)
+        rows = None if candidates is None else self.rows_for(candidates)
+
+        examples = self._matrix[pos].astype(np.float32)
+        if mode == "centroid":
+            # Mean of dot products == dot product with the mean, so this stays a single mat-vec
+            scores = self._scores(self.normalize(examples.mean(axis=0)), rows)
+        elif mode == "max" or not len(neg):
+            scores = self._reduce_scores(examples, rows, lambda s: s.max(axis=1))
+        else:
+            p = len(pos)
+            queries = np.vstack([examples, self._matrix[neg].astype(np.float32)])
+            scores = self._reduce_scores(
+                queries, rows, lambda s: s[:, :p].max(axis=1) - negative_weight * s[:, p:].max(axis=1)
+            )
+        return self._ranked(scores, rows, k)
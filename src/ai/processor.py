@@ -1,17 +1,25 @@
 import torch
 from sentence_transformers import SentenceTransformer
 from PIL import Image
-from typing import List, Union
+from typing import List
+from collections import OrderedDict
+import threading
 import numpy as np
 
 class ImageProcessor:
     def __init__(self, model_name: str = "sentence-transformers/clip-ViT-B-32"):
         # Load model. Streamlit will cache the instance if we wrapper it right, 
         # but here we just define the class.
+        self.model_name = model_name
         self.device = "mps" if torch.backends.mps.is_available() else "cpu"
         print(f"Loading AI model on {self.device}...")
         self.model = SentenceTransformer(model_name, device=self.device)
         print("Model loaded.")
+        # prompt -> embedding, so re-ranking by the same prompt never re-runs the text encoder.
+        # The processor is shared by every session, so the memo is only touched under the lock.
+        self._text_cache = OrderedDict()
+        self._text_cache_lock = threading.Lock()
+        self.text_cache_size = 1024
 
     def encode_images(self, images: List[Image.Image]) -> np.ndarray:
         """
@@ -23,10 +31,34 @@ class ImageProcessor:
 
     def encode_text(self, text: str) -> np.ndarray:
         """
-        Compute embedding for a text query.
+        Compute embedding for a text query (memoized per prompt string).
         """
-        embedding = self.model.encode(text, convert_to_numpy=True)
-        return embedding
+        return self.encode_texts([text])[0]
+
+    def encode_texts(self, texts: List[str]) -> np.ndarray:
+        """
+        Compute embeddings for many text queries.
+        Prompts that were seen before come from the memo, the rest go through the model in one batch.
+        """
+        # Copy out what's memoized; another session may evict it right after we let go
+        with self._text_cache_lock:
+            found = {t: self._text_cache[t] for t in texts if t in self._text_cache}
+        missing = list(dict.fromkeys(t for t in texts if t not in found))
+        if missing:
+            # Outside the lock, the model is the slow part
+            embeddings = self.model.encode(missing, batch_size=32, convert_to_numpy=True)
+            found.update(zip(missing, embeddings))
+
+        result = np.stack([found[t] for t in texts])
+
+        # Refresh LRU order and drop the oldest prompts
+        with self._text_cache_lock:
+            for text in texts:
+                self._text_cache[text] = found[text]
+                self._text_cache.move_to_end(text)
+            while len(self._text_cache) > self.text_cache_size:
+                self._text_cache.popitem(last=False)
+        return result
         
     def calculate_similarity(self, source_embedding: np.ndarray, candidate_embeddings: np.ndarray) -> np.ndarray:
         """
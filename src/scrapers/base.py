@@ -1,14 +1,379 @@
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+import asyncio
+import random
+import time
+
+from .browser_pool import DEFAULT_USER_AGENT, BrowserPool, get_browser_pool
+from .network import INITIAL_STATE_JS, ablock_heavy_resources, block_heavy_resources
+
+SCROLL_JS = "window.scrollTo(0, document.body.scrollHeight)"
+
+# Scrolls, then resolves as soon as the next batch of images has landed:
+# the first <img> added (or src/srcset changed) starts a short settle timer that
+# restarts on every further image mutation. Resolves false if nothing arrives in time.
+SCROLL_AND_WAIT_JS = """
+async ({timeout, settle}) => {
+    window.scrollTo(0, document.body.scrollHeight);
+    return await new Promise(resolve => {
+        let settleTimer = null;
+        let deadline = null;
+        const touchesImage = (m) => m.type === "attributes"
+            ? m.target.tagName === "IMG"
+            : Array.from(m.addedNodes).some(n => n.nodeType === 1 && (n.tagName === "IMG" || n.querySelector("img")));
+        const observer = new MutationObserver((mutations) => {
+            if (!mutations.some(touchesImage)) return;
+            clearTimeout(settleTimer);
+            settleTimer = setTimeout(() => finish(true), settle);
+        });
+        const finish = (grew) => {
+            observer.disconnect();
+            clearTimeout(settleTimer);
+            clearTimeout(deadline);
+            resolve(grew);
+        };
+        observer.observe(document.body, {childList: true, subtree: true, attributes: true, attributeFilter: ["src", "srcset"]});
+        deadline = setTimeout(() => finish(false), timeout);
+    });
+}
+"""
+
+# Collects candidate URLs from every <img> not seen on a previous call, in one round trip.
+# __PICK__ is replaced with the scraper's pick_js. Elements are marked as seen once they
+# have a real src, so lazy placeholders are looked at again after they load.
+EXTRACT_TEMPLATE_JS = """
+(selectors) => {
+    const pick = __PICK__;
+    let scope = [];
+    for (const selector of selectors) {
+        scope = document.querySelectorAll(selector);
+        if (scope.length) break;
+    }
+    const urls = [];
+    for (const img of scope) {
+        if (img.dataset.curatorSeen) continue;
+        const url = pick(img);
+        if (url) urls.push(url);
+        if (url || (img.getAttribute("src") || "").startsWith("http")) img.dataset.curatorSeen = "1";
+    }
+    return urls;
+}
+"""
+
+@dataclass
+class ScrapedImage:
+    """
+    An image found by a scraper, with whatever the site told us about it.
+    Only network mode knows dimensions and captions; DOM mode just has the URL
+    and the query that found it.
+    """
+    url: str
+    width: Optional[int] = None
+    height: Optional[int] = None
+    caption: Optional[str] = None
+    source: Optional[str] = None
+    query: Optional[str] = None
+
 
 class BaseScraper(ABC):
-    def __init__(self, limit: int = 50):
+    """
+    Scrolls a search results page and collects image URLs.
+
+    Subclasses describe the site (search_url, which <img> to look at, and pick_js:
+    a JS function turning one <img> element into a full-size URL or null); the scroll
+    loop itself lives here, once for the sync API (search, on the shared BrowserPool)
+    and once for the async API (asearch).
+
+    mode="network" skips rendering instead: images/fonts/CSS are blocked and image
+    URLs, sizes and captions are read from the JSON feeds the site loads while
+    scrolling (scrapers opt in with feed_url_patterns and parse_feed).
+    """
+    name = "Base"
+
+    # Selectors tried in order, the first one that matches anything wins
+    img_selectors: Sequence[str] = ("img",)
+    # (img) => url | null, runs in the page
+    pick_js = """(img) => { const src = img.getAttribute("src"); return src && src.startsWith("http") ? src : null; }"""
+    max_scrolls = 5
+    # Consecutive scrolls without new images before giving up (None: always do max_scrolls)
+    patience: Optional[int] = 1
+
+    # Network mode: substrings of XHR/fetch URLs whose JSON holds search results
+    feed_url_patterns: Sequence[str] = ()
+    # Network mode: ids of <script> tags holding server-rendered JSON (the first page of results)
+    initial_state_ids: Sequence[str] = ()
+
+    def __init__(self, limit: int = 50, pool: Optional[BrowserPool] = None,
+                 scroll_timeout: float = 5.0, settle_time: float = 0.3,
+                 scroll_delay: Tuple[float, float] = (0.0, 0.0), mode: str = "dom"):
+        """
+        scroll_timeout: max seconds to wait for new images after a scroll.
+        settle_time: quiet period that marks the end of a batch of new images.
+        scroll_delay: (min, max) seconds between scrolls regardless of how fast
+            content arrives, for politeness. Off by default.
+        mode: "dom" (render and read <img> tags) or "network" (read JSON feeds).
+        """
+        if mode not in ("dom", "network"):
+            raise ValueError(f"Unknown scrape mode {mode!r}.")
+        if mode == "network" and not self.feed_url_patterns:
+            raise ValueError(f"{self.name} does not support network mode.")
         self.limit = limit
+        self.pool = pool
+        self.scroll_timeout = scroll_timeout
+        self.settle_time = settle_time
+        self.scroll_delay = scroll_delay
+        self.mode = mode
+        # url -> ScrapedImage for everything a search returned (sizes/captions in network mode only)
+        self.metadata: Dict[str, ScrapedImage] = {}
+
+    def _wait_args(self) -> Dict[str, int]:
+        return {"timeout": int(self.scroll_timeout * 1000), "settle": int(self.settle_time * 1000)}
+
+    def _politeness_remaining(self, started: float) -> float:
+        return random.uniform(*self.scroll_delay) - (time.monotonic() - started)
 
     @abstractmethod
+    def search_url(self, query: str) -> str:
+        pass
+
+    @property
+    def extract_js(self) -> str:
+        return EXTRACT_TEMPLATE_JS.replace("__PICK__", self.pick_js)
+
+    def parse_feed(self, payload: Any) -> List[ScrapedImage]:
+        """
+        Images found in one decoded feed payload (network mode).
+        """
+        return []
+
+    def _is_feed(self, response) -> bool:
+        return (response.request.resource_type in ("xhr", "fetch")
+                and any(p in response.url for p in self.feed_url_patterns))
+
+    def _collect(self, items: List[ScrapedImage], image_urls: Set[str]):
+        for item in items:
+            if item.source is None:
+                item.source = self.name
+            self.metadata.setdefault(item.url, item)
+            image_urls.add(item.url)
+
+    def _found(self, image_urls: Set[str], query: str) -> List[str]:
+        # The results of one search, each remembered with the first query that found it
+        urls = list(image_urls)[:self.limit]
+        for url in urls:
+            item = self.metadata.setdefault(url, ScrapedImage(url, source=self.name))
+            if item.query is None:
+                item.query = query
+        return urls
+
     def search(self, query: str) -> List[str]:
         """
         Search for images based on a query.
         Returns a list of image URLs.
         """
-        pass
+        print(f"Searching {self.name} for: {query}")
+        # Filled as we go, so a failed scroll still returns what was found before it
+        image_urls: Set[str] = set()
+
+        pool = self.pool or get_browser_pool()
+        try:
+            pool.run(lambda page: self.scrape(page, query, image_urls))
+        except Exception as e:
+            print(f"Error scraping {self.name}: {e}")
+
+        return self._found(image_urls, query)
+
+    def scrape(self, page, query: str, image_urls: Set[str]):
+        if self.mode == "network":
+            self.scrape_feeds(page, query, image_urls)
+        else:
+            self.scrape_dom(page, query, image_urls)
+
+    def scrape_dom(self, page, query: str, image_urls: Set[str]):
+        page.goto(self.search_url(query), wait_until="domcontentloaded")
+
+        # Scroll to trigger lazy loading
+        stale = 0
+        for _ in range(self.max_scrolls):
+            current_count = len(image_urls)
+            image_urls.update(self.extract(page))
+            if len(image_urls) >= self.limit:
+                break
+
+            self.scroll_and_wait(page)
+
+            stale = stale + 1 if len(image_urls) == current_count else 0
+            if self.patience is not None and stale >= self.patience:
+                break
+
+    def scrape_feeds(self, page, query: str, image_urls: Set[str]):
+        responses = []
+        page.route("**/*", block_heavy_resources)
+        # Only queue here: bodies are read from the loop below, not inside the event handler
+        page.on("response", lambda r: responses.append(r) if self._is_feed(r) else None)
+
+        page.goto(self.search_url(query), wait_until="domcontentloaded")
+        if self.initial_state_ids:
+            self._collect(self.parse_feed(page.evaluate(INITIAL_STATE_JS, list(self.initial_state_ids))), image_urls)
+
+        stale = 0
+        for _ in range(self.max_scrolls):
+            current_count = len(image_urls)
+            while responses:
+                self._collect(self._read_feed(responses.pop(0)), image_urls)
+            if len(image_urls) >= self.limit:
+                break
+
+            started = time.monotonic()
+            try:
+                # Next page of results arrives as a feed response, not as rendered images
+                with page.expect_response(self._is_feed, timeout=self.scroll_timeout * 1000):
+                    page.evaluate(SCROLL_JS)
+            except Exception:
+                pass
+            remaining = self._politeness_remaining(started)
+            if remaining > 0:
+                time.sleep(remaining)
+
+            while responses:
+                self._collect(self._read_feed(responses.pop(0)), image_urls)
+            stale = stale + 1 if len(image_urls) == current_count else 0
+            if self.patience is not None and stale >= self.patience:
+                break
+
+    def _read_feed(self, response) -> List[ScrapedImage]:
+        try:
+            return self.parse_feed(response.json())
+        except Exception:
+            # Not JSON (or the body is gone): not a feed after all
+            return []
+
+    def scroll_and_wait(self, page):
+        """
+        Scroll to the bottom and return once new images have loaded (or scroll_timeout passes).
+        """
+        started = time.monotonic()
+        try:
+            page.evaluate(SCROLL_AND_WAIT_JS, self._wait_args())
+        except Exception as e:
+            # e.g. the page navigated mid-wait; the next extract will tell us what we have
+            print(f"{self.name}: scroll wait interrupted: {e}")
+        remaining = self._politeness_remaining(started)
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def extract(self, page) -> List[str]:
+        """
+        Candidate URLs from images added since the last call, in a single page.evaluate.
+        """
+        return page.evaluate(self.extract_js, list(self.img_selectors))
+
+    # --- async API ---
+
+    async def asearch(self, query: str, browser=None) -> List[str]:
+        """
+        Async variant of search() on playwright.async_api.
+        Pass a shared async Browser to run many searches on one Chromium;
+        without one, a browser is launched just for this search.
+        """
+        print(f"Searching {self.name} for: {query}")
+        image_urls: Set[str] = set()
+
+        try:
+            if browser is not None:
+                await self._ascrape_in(browser, query, image_urls)
+            else:
+                from playwright.async_api import async_playwright
+                async with async_playwright() as p:
+                    own_browser = await p.chromium.launch(headless=True)
+                    try:
+                        await self._ascrape_in(own_browser, query, image_urls)
+                    finally:
+                        await own_browser.close()
+        except Exception as e:
+            print(f"Error scraping {self.name}: {e}")
+
+        return self._found(image_urls, query)
+
+    async def _ascrape_in(self, browser, query: str, image_urls: Set[str]):
+        context = await browser.new_context(user_agent=DEFAULT_USER_AGENT)
+        try:
+            page = await context.new_page()
+            await self.ascrape(page, query, image_urls)
+        finally:
+            await context.close()
+
+    async def ascrape(self, page, query: str, image_urls: Set[str]):
+        if self.mode == "network":
+            await self.ascrape_feeds(page, query, image_urls)
+        else:
+            await self.ascrape_dom(page, query, image_urls)
+
+    async def ascrape_dom(self, page, query: str, image_urls: Set[str]):
+        await page.goto(self.search_url(query), wait_until="domcontentloaded")
+
+        stale = 0
+        for _ in range(self.max_scrolls):
+            current_count = len(image_urls)
+            image_urls.update(await self.aextract(page))
+            if len(image_urls) >= self.limit:
+                break
+
+            await self.ascroll_and_wait(page)
+
+            stale = stale + 1 if len(image_urls) == current_count else 0
+            if self.patience is not None and stale >= self.patience:
+                break
+
+    async def ascrape_feeds(self, page, query: str, image_urls: Set[str]):
+        responses = []
+        await page.route("**/*", ablock_heavy_resources)
+        page.on("response", lambda r: responses.append(r) if self._is_feed(r) else None)
+
+        await page.goto(self.search_url(query), wait_until="domcontentloaded")
+        if self.initial_state_ids:
+            self._collect(self.parse_feed(await page.evaluate(INITIAL_STATE_JS, list(self.initial_state_ids))), image_urls)
+
+        stale = 0
+        for _ in range(self.max_scrolls):
+            current_count = len(image_urls)
+            while responses:
+                self._collect(await self._aread_feed(responses.pop(0)), image_urls)
+            if len(image_urls) >= self.limit:
+                break
+
+            started = time.monotonic()
+            try:
+                async with page.expect_response(self._is_feed, timeout=self.scroll_timeout * 1000):
+                    await page.evaluate(SCROLL_JS)
+            except Exception:
+                pass
+            remaining = self._politeness_remaining(started)
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+
+            while responses:
+                self._collect(await self._aread_feed(responses.pop(0)), image_urls)
+            stale = stale + 1 if len(image_urls) == current_count else 0
+            if self.patience is not None and stale >= self.patience:
+                break
+
+    async def _aread_feed(self, response) -> List[ScrapedImage]:
+        try:
+            return self.parse_feed(await response.json())
+        except Exception:
+            return []
+
+    async def ascroll_and_wait(self, page):
+        started = time.monotonic()
+        try:
+            await page.evaluate(SCROLL_AND_WAIT_JS, self._wait_args())
+        except Exception as e:
+            print(f"{self.name}: scroll wait interrupted: {e}")
+        remaining = self._politeness_remaining(started)
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+
+    async def aextract(self, page) -> List[str]:
+        return await page.evaluate(self.extract_js, list(self.img_selectors))
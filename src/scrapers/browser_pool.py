@@ -0,0 +1,251 @@
+import asyncio
+import atexit
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, List, Optional, TypeVar
+
+from playwright.sync_api import Page, sync_playwright
+
+DEFAULT_USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+T = TypeVar("T")
+
+
+class _BrowserWorker(threading.Thread):
+    """
+    Owns one Playwright instance and one Chromium.
+    Sync Playwright objects may only be used from the thread that created them,
+    so every job for this browser runs here.
+    """
+
+    def __init__(self, pool: "BrowserPool", index: int):
+        super().__init__(name=f"browser-pool-{index}", daemon=True)
+        self.pool = pool
+        self._playwright = None
+        self._browser = None
+
+    def run(self):
+        while True:
+            try:
+                job = self.pool._jobs.get(timeout=self.pool.idle_timeout)
+            except queue.Empty:
+                # Idle for a while: give the memory back, relaunch on the next job
+                self._shutdown()
+                continue
+            if job is None:
+                break
+            fn, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._run(fn))
+            except BaseException as e:
+                future.set_exception(e)
+        self._shutdown()
+
+    def _ensure_browser(self):
+        if self._browser is not None and self._browser.is_connected():
+            return self._browser
+        self._shutdown()
+        self._playwright = sync_playwright().start()
+        self._browser = self._playwright.chromium.launch(headless=self.pool.headless)
+        return self._browser
+
+    def _run_once(self, fn: Callable[[Page], T]) -> T:
+        browser = self._ensure_browser()
+        # A fresh context per job keeps cookies/storage isolated between searches
+        context = browser.new_context(user_agent=self.pool.user_agent)
+        try:
+            page = context.new_page()
+            return fn(page)
+        finally:
+            try:
+                context.close()
+            except Exception:
+                pass
+
+    def _run(self, fn: Callable[[Page], T]) -> T:
+        try:
+            return self._run_once(fn)
+        except Exception:
+            if self._browser is None or self._browser.is_connected():
+                # Launch failed, or the job itself failed: nothing to recover
+                raise
+            # Chromium died under us (crash, OOM kill): relaunch and retry once
+            print("Browser disconnected, relaunching...")
+            self._shutdown()
+            return self._run_once(fn)
+
+    def _shutdown(self):
+        if self._browser is not None:
+            try:
+                self._browser.close()
+            except Exception:
+                pass
+            self._browser = None
+        if self._playwright is not None:
+            try:
+                self._playwright.stop()
+            except Exception:
+                pass
+            self._playwright = None
+
+
+class _AsyncBrowserHost:
+    """
+    One long-lived async Playwright Chromium on its own event loop thread, for
+    callers that drive many pages concurrently (see multi.search_all).
+    Launched on first use, closed after the pool's idle_timeout without work,
+    relaunched on demand (also when it crashed).
+    """
+
+    def __init__(self, pool: "BrowserPool"):
+        self.pool = pool
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="browser-pool-async", daemon=True)
+        self._thread.start()
+        self._playwright = None
+        self._browser = None
+        self._launch_lock: Optional[asyncio.Lock] = None
+        self._active = 0
+        self._idle_timer: Optional[asyncio.TimerHandle] = None
+
+    async def _ensure_browser(self):
+        if self._launch_lock is None:
+            self._launch_lock = asyncio.Lock()
+        async with self._launch_lock:
+            if self._browser is not None and self._browser.is_connected():
+                return self._browser
+            await self._shutdown()
+            from playwright.async_api import async_playwright
+            self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch(headless=self.pool.headless)
+            return self._browser
+
+    async def _call(self, fn: Callable[[Any], Awaitable[T]]) -> T:
+        self._active += 1
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+        try:
+            return await fn(await self._ensure_browser())
+        finally:
+            self._active -= 1
+            if not self._active:
+                self._idle_timer = self._loop.call_later(
+                    self.pool.idle_timeout, lambda: self._loop.create_task(self._close_if_idle()))
+
+    async def _close_if_idle(self):
+        if not self._active:
+            await self._shutdown()
+
+    async def _shutdown(self):
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except Exception:
+                pass
+            self._browser = None
+        if self._playwright is not None:
+            try:
+                await self._playwright.stop()
+            except Exception:
+                pass
+            self._playwright = None
+
+    def run(self, fn: Callable[[Any], Awaitable[T]], timeout: Optional[float] = None) -> T:
+        future = asyncio.run_coroutine_threadsafe(self._call(fn), self._loop)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def close(self):
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(10)
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=10)
+
+
+class BrowserPool:
+    """
+    A small pool of long-lived headless Chromium browsers shared by all scrapers.
+
+    Jobs are functions that receive a fresh Page (in its own browser context) and
+    run on one of `size` worker threads, so back-to-back and concurrent searches
+    reuse warm browsers instead of paying the launch cost every time.
+    Browsers are closed after `idle_timeout` seconds without work and relaunched
+    on demand; a crashed browser is relaunched and the job retried once.
+    run_async() gives concurrent async jobs one more long-lived Chromium, driven
+    from its own event loop.
+    """
+
+    def __init__(self, size: int = 2, idle_timeout: float = 300.0, headless: bool = True,
+                 user_agent: str = DEFAULT_USER_AGENT):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.headless = headless
+        self.user_agent = user_agent
+        self._jobs: "queue.Queue" = queue.Queue()
+        self._workers: List[_BrowserWorker] = []
+        self._async: Optional[_AsyncBrowserHost] = None
+        self._lock = threading.Lock()
+
+    def _start_workers(self):
+        with self._lock:
+            self._workers = [w for w in self._workers if w.is_alive()]
+            while len(self._workers) < self.size:
+                worker = _BrowserWorker(self, len(self._workers))
+                worker.start()
+                self._workers.append(worker)
+
+    def run(self, fn: Callable[[Page], T], timeout: Optional[float] = None) -> T:
+        """
+        Run fn(page) on a pooled browser and return its result (or raise its exception).
+        """
+        self._start_workers()
+        future: Future = Future()
+        self._jobs.put((fn, future))
+        return future.result(timeout)
+
+    def run_async(self, fn: Callable[[Any], Awaitable[T]], timeout: Optional[float] = None) -> T:
+        """
+        Run `await fn(browser)` with the pool's async Browser (playwright.async_api)
+        and return its result. fn may open as many contexts/pages as it likes, but
+        must close them; the browser itself stays up for the next call.
+        """
+        with self._lock:
+            if self._async is None:
+                self._async = _AsyncBrowserHost(self)
+            host = self._async
+        return host.run(fn, timeout)
+
+    def close(self):
+        with self._lock:
+            workers, self._workers = self._workers, []
+            host, self._async = self._async, None
+        if host is not None:
+            host.close()
+        for _ in workers:
+            self._jobs.put(None)
+        for worker in workers:
+            worker.join(timeout=10)
+
+
+_shared_pool: Optional[BrowserPool] = None
+_shared_lock = threading.Lock()
+
+
+def get_browser_pool() -> BrowserPool:
+    """
+    Process-wide pool used by scrapers that aren't given one explicitly.
+    """
+    global _shared_pool
+    with _shared_lock:
+        if _shared_pool is None:
+            _shared_pool = BrowserPool()
+            atexit.register(_shared_pool.close)
+        return _shared_pool
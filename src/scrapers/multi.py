@@ -0,0 +1,63 @@
+import asyncio
+from typing import Iterable, List, Optional, Sequence
+
+from .base import BaseScraper
+from .browser_pool import BrowserPool, get_browser_pool
+
+
+def merge_results(results: Iterable[List[str]], limit: Optional[int] = None) -> List[str]:
+    """
+    Merge several result lists round-robin so every source/query is represented
+    near the top, dropping duplicate URLs.
+    """
+    lists = [list(r) for r in results]
+    merged = []
+    seen = set()
+    for i in range(max((len(l) for l in lists), default=0)):
+        for l in lists:
+            if i < len(l) and l[i] not in seen:
+                seen.add(l[i])
+                merged.append(l[i])
+    return merged[:limit] if limit is not None else merged
+
+
+async def search_all(scrapers: Sequence[BaseScraper], queries: Sequence[str],
+                     max_pages: int = 6, limit: Optional[int] = None, browser=None) -> List[str]:
+    """
+    Run every (scraper, query) pair concurrently on one event loop and one Chromium.
+    Each search gets its own context/page; at most max_pages are open at a time.
+    Total time approaches the slowest single search instead of the sum.
+    Pass a long-lived async Browser (see search_all_pooled); without one, a browser
+    is launched just for this call.
+    """
+    jobs = [(scraper, query) for scraper in scrapers for query in queries]
+    if not jobs:
+        return []
+
+    if browser is None:
+        from playwright.async_api import async_playwright
+
+        async with async_playwright() as p:
+            own_browser = await p.chromium.launch(headless=True)
+            try:
+                return await search_all(scrapers, queries, max_pages, limit, browser=own_browser)
+            finally:
+                await own_browser.close()
+
+    semaphore = asyncio.Semaphore(max_pages)
+
+    async def run(scraper: BaseScraper, query: str) -> List[str]:
+        async with semaphore:
+            return await scraper.asearch(query, browser=browser)
+
+    results = await asyncio.gather(*(run(s, q) for s, q in jobs))
+    return merge_results(results, limit)
+
+
+def search_all_pooled(scrapers: Sequence[BaseScraper], queries: Sequence[str], max_pages: int = 6,
+                      limit: Optional[int] = None, pool: Optional[BrowserPool] = None) -> List[str]:
+    """
+    search_all on the browser pool's warm async Chromium, from synchronous code.
+    """
+    pool = pool or get_browser_pool()
+    return pool.run_async(lambda browser: search_all(scrapers, queries, max_pages, limit, browser=browser))
@@ -0,0 +1,48 @@
+from collections import deque
+from typing import Any, Iterator, Optional, Tuple
+
+# Resource types we never need when harvesting URLs from JSON feeds
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font", "stylesheet"}
+
+# Reads a JSON blob the site embeds in the first HTML response, if any.
+# Search results are often server-rendered there instead of fetched via XHR.
+INITIAL_STATE_JS = """
+(ids) => {
+    for (const id of ids) {
+        const el = document.getElementById(id);
+        if (!el) continue;
+        try { return JSON.parse(el.textContent); } catch (e) {}
+    }
+    return null;
+}
+"""
+
+
+def block_heavy_resources(route):
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        route.abort()
+    else:
+        route.continue_()
+
+
+async def ablock_heavy_resources(route):
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+def walk_json(obj: Any, context: Optional[dict] = None) -> Iterator[Tuple[dict, Optional[dict]]]:
+    """
+    Yield every dict in a decoded JSON payload together with its nearest enclosing dict.
+    Feed formats change often; walking the whole tree and recognizing image-like
+    objects by shape is more robust than hard-coding paths.
+    """
+    queue = deque([(obj, context)])
+    while queue:
+        node, parent = queue.popleft()
+        if isinstance(node, dict):
+            yield node, parent
+            queue.extend((v, node) for v in node.values() if isinstance(v, (dict, list)))
+        elif isinstance(node, list):
+            queue.extend((v, parent) for v in node if isinstance(v, (dict, list)))
@@ -1,40 +1,407 @@
 import aiohttp
 import asyncio
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from PIL import Image
 from io import BytesIO
-from typing import List, Optional, Tuple
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
 
-async def download_image(session: aiohttp.ClientSession, url: str) -> Tuple[str, Optional[Image.Image]]:
+from src.utils.http_cache import DiskCache
+from src.utils.throttle import HostLimiter, RetryPolicy, parse_retry_after
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+}
+
+@dataclass
+class DownloadFailure:
+    url: str
+    reason: str
+    status: Optional[int] = None
+    attempts: int = 1
+
+@dataclass
+class DownloadReport:
     """
-    Downloads a single image and returns (url, PIL.Image object).
-    Returns (url, None) on failure.
+    Result of download_images_parallel: the decoded images, and why the rest failed.
+    """
+    images: Dict[str, Image.Image] = field(default_factory=dict)
+    failures: Dict[str, DownloadFailure] = field(default_factory=dict)
+
+DEFAULT_RETRY = RetryPolicy()
+
+# Some CDNs serve images without a proper type
+_GENERIC_CONTENT_TYPES = {"application/octet-stream", "binary/octet-stream"}
+
+@dataclass
+class DownloadLimits:
+    """
+    What we're willing to download. Checked as early as possible: Content-Type and
+    Content-Length before reading the body, the byte cap while streaming it, and the
+    resolution from the image header before anything gets decoded.
+    """
+    max_bytes: int = 25 * 1024 * 1024
+    min_side: int = 64
+    max_side: int = 16384
+    # Decompression bomb guard: a small file can still decode to gigabytes
+    max_pixels: int = 64_000_000
+    chunk_size: int = 64 * 1024
+    # How much of the body to buffer before trying the header probe. If the header isn't
+    # complete by then it's retried at 2x, 4x... probe_bytes, max_probes times in all;
+    # after that only the full body is checked.
+    probe_bytes: int = 32 * 1024
+    max_probes: int = 4
+
+    def check_content_type(self, content_type: Optional[str]) -> Optional[str]:
+        if not content_type:
+            return None
+        mime = content_type.split(";")[0].strip().lower()
+        if mime == "image/svg+xml" or not (mime.startswith("image/") or mime in _GENERIC_CONTENT_TYPES):
+            return f"unexpected content type {mime}"
+        return None
+
+    def check_dimensions(self, width: int, height: int) -> Optional[str]:
+        if min(width, height) < self.min_side:
+            return f"too small ({width}x{height})"
+        if max(width, height) > self.max_side or width * height > self.max_pixels:
+            return f"too large ({width}x{height})"
+        return None
+
+DEFAULT_LIMITS = DownloadLimits()
+
+def probe_image_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """
+    (width, height) from the image header alone, without decoding any pixels.
+    None if data doesn't start with a readable image header (yet).
+    """
+    try:
+        with Image.open(BytesIO(data)) as image:
+            return image.size
+    except Image.DecompressionBombError:
+        # Pillow refuses to even open these; report something check_dimensions rejects
+        return (2 ** 31, 2 ** 31)
+    except Exception:
+        return None
+
+class _RequestError(Exception):
+    def __init__(self, reason: str, status: Optional[int] = None, retryable: bool = False,
+                 throttled: bool = False, retry_after: Optional[float] = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.status = status
+        self.retryable = retryable
+        self.throttled = throttled
+        self.retry_after = retry_after
+
+async def _read_body(response, limits: DownloadLimits) -> bytes:
+    """
+    Streams a 200 response body under limits, giving up as soon as the headers,
+    the byte count or the image header rule it out. Raises _RequestError.
+    """
+    reason = limits.check_content_type(response.headers.get("Content-Type"))
+    if reason is None:
+        length = response.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > limits.max_bytes:
+            reason = f"too many bytes ({int(length)})"
+    if reason is not None:
+        raise _RequestError(reason, status=response.status)
+
+    buffer = bytearray()
+    probed = False
+    probes = 0
+    next_probe = limits.probe_bytes
+    async for chunk in response.content.iter_chunked(limits.chunk_size):
+        buffer.extend(chunk)
+        if len(buffer) > limits.max_bytes:
+            raise _RequestError(f"too many bytes (over {limits.max_bytes})", status=response.status)
+        if not probed and probes < limits.max_probes and len(buffer) >= next_probe:
+            # Doubling keeps the copies and parses of a headerless body at O(n), not O(n^2)
+            probed = _check_header(bytes(buffer), limits, partial=True)
+            probes += 1
+            next_probe *= 2
+    data = bytes(buffer)
+    if not probed:
+        _check_header(data, limits, partial=False)
+    return data
+
+def _check_header(data: bytes, limits: DownloadLimits, partial: bool) -> bool:
+    """
+    True if the image header was readable and within limits, False if a partial body
+    doesn't contain the whole header yet. Raises _RequestError otherwise.
+    """
+    size = probe_image_size(data)
+    if size is None:
+        if partial:
+            return False
+        raise _RequestError("not an image")
+    reason = limits.check_dimensions(*size)
+    if reason is not None:
+        raise _RequestError(reason)
+    return True
+
+async def _request(session: aiohttp.ClientSession, url: str, cache: Optional[DiskCache],
+                   retry: RetryPolicy, limits: DownloadLimits) -> bytes:
     """
+    One GET, revalidating a stale cache entry if there is one. Raises _RequestError.
+    """
+    loop = asyncio.get_running_loop()
+    entry = await loop.run_in_executor(None, cache.lookup, url) if cache is not None else None
+    headers = {}
+    if entry is not None:
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+
     try:
-        async with session.get(url, timeout=10) as response:
+        async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=10)) as response:
+            if response.status == 304 and entry is not None:
+                data = await loop.run_in_executor(None, cache.read, entry)
+                if data is None:
+                    # Blob went missing under us, the next attempt fetches it for real
+                    raise _RequestError("cached body missing", retryable=True)
+                cache.revalidated(url, response.headers.get("Cache-Control"))
+                return data
             if response.status == 200:
-                data = await response.read()
-                image = Image.open(BytesIO(data)).convert("RGB")
-                return url, image
-            return url, None
-    except Exception as e:
-        # print(f"Failed to download {url}: {e}")
+                data = await _read_body(response, limits)
+                if cache is not None:
+                    await loop.run_in_executor(None, cache.put, url, data,
+                                               response.headers.get("ETag"),
+                                               response.headers.get("Last-Modified"),
+                                               response.headers.get("Cache-Control"))
+                return data
+            raise _RequestError(f"HTTP {response.status}", status=response.status,
+                                retryable=response.status in retry.retry_statuses,
+                                throttled=response.status in (429, 503),
+                                retry_after=parse_retry_after(response.headers.get("Retry-After")))
+    except asyncio.TimeoutError:
+        # A slow host is as much a sign of overload as a 429
+        raise _RequestError("timeout", retryable=True, throttled=True)
+    except aiohttp.ClientError as e:
+        raise _RequestError(f"connection error: {type(e).__name__}", retryable=True)
+
+async def fetch_image(session: aiohttp.ClientSession, url: str,
+                      cache: Optional[DiskCache] = None,
+                      limiter: Optional[HostLimiter] = None,
+                      retry: RetryPolicy = DEFAULT_RETRY,
+                      limits: DownloadLimits = DEFAULT_LIMITS,
+                      slots: Optional[asyncio.Semaphore] = None) -> Tuple[Optional[bytes], Optional[DownloadFailure]]:
+    """
+    Downloads the raw bytes of a single image, returns (bytes, None) or (None, failure).
+    429/5xx/timeouts/connection errors are retried with exponential backoff and jitter,
+    honoring Retry-After. With a limiter, requests take a slot of their host's AIMD limit,
+    and throttling responses shrink it for every request to that host.
+    With a cache, fresh entries are served from disk without touching the network,
+    stale ones are revalidated with a conditional GET (304 -> cached bytes),
+    and new 200 responses are stored.
+    Bodies that break `limits` (wrong type, too many bytes, resolution out of range)
+    fail right away without retries.
+    slots is an overall cap on open requests. A slot is only taken once the host
+    has let the request through and only for the request itself, never during
+    backoff or Retry-After waits, so a throttled host can't starve the others.
+    """
+    if cache is not None:
+        loop = asyncio.get_running_loop()
+        entry = await loop.run_in_executor(None, cache.lookup, url)
+        if entry is not None and entry.fresh:
+            data = await loop.run_in_executor(None, cache.read, entry)
+            if data is not None:
+                # Limits may be stricter than when this was stored
+                try:
+                    _check_header(data, limits, partial=False)
+                except _RequestError as e:
+                    return None, DownloadFailure(url, e.reason, attempts=0)
+                return data, None
+
+    async def request() -> bytes:
+        if slots is None:
+            return await _request(session, url, cache, retry, limits)
+        async with slots:
+            return await _request(session, url, cache, retry, limits)
+
+    for attempt in range(1, retry.max_attempts + 1):
+        host = limiter.for_url(url) if limiter is not None else None
+        try:
+            if host is not None:
+                async with host:
+                    data = await request()
+                host.on_success()
+            else:
+                data = await request()
+            return data, None
+        except _RequestError as e:
+            if host is not None and e.throttled:
+                host.on_throttle()
+                if e.retry_after:
+                    host.pause(e.retry_after)
+            if not e.retryable or attempt == retry.max_attempts:
+                return None, DownloadFailure(url, e.reason, e.status, attempt)
+            await asyncio.sleep(e.retry_after if e.retry_after is not None else retry.backoff(attempt))
+        except Exception as e:
+            return None, DownloadFailure(url, f"{type(e).__name__}: {e}", attempts=attempt)
+
+async def fetch_image_bytes(session: aiohttp.ClientSession, url: str,
+                            cache: Optional[DiskCache] = None,
+                            limiter: Optional[HostLimiter] = None,
+                            retry: RetryPolicy = DEFAULT_RETRY,
+                            limits: DownloadLimits = DEFAULT_LIMITS,
+                            slots: Optional[asyncio.Semaphore] = None) -> Tuple[str, Optional[bytes]]:
+    """
+    fetch_image for callers that don't care why it failed.
+    Returns (url, None) on failure.
+    """
+    data, _ = await fetch_image(session, url, cache, limiter, retry, limits, slots)
+    return url, data
+
+# CLIP's input resolution. Decoding bigger than this is wasted work when we only embed.
+EMBED_DRAFT_SIZE = 224
+
+_decode_executor: Optional[Executor] = None
+_decode_executor_lock = threading.Lock()
+
+def make_decode_executor(kind: str = "thread", max_workers: Optional[int] = None) -> Executor:
+    """
+    Creates an executor for decode_image.
+    "thread" is enough in most cases since Pillow releases the GIL while decoding;
+    "process" sidesteps the GIL completely at the cost of pickling the decoded pixels back.
+    """
+    max_workers = max_workers or min(8, os.cpu_count() or 1)
+    if kind == "thread":
+        return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="decode")
+    if kind == "process":
+        return ProcessPoolExecutor(max_workers=max_workers)
+    raise ValueError(f"Unknown executor kind {kind!r}, expected 'thread' or 'process'.")
+
+def set_decode_executor(executor: Optional[Executor]):
+    """
+    Replaces the shared decode executor (None goes back to the default thread pool).
+    The previous executor is not shut down, that's up to whoever created it.
+    """
+    global _decode_executor
+    with _decode_executor_lock:
+        _decode_executor = executor
+
+def get_decode_executor() -> Executor:
+    """
+    The shared executor all downloads decode on, created on first use.
+    """
+    global _decode_executor
+    with _decode_executor_lock:
+        if _decode_executor is None:
+            _decode_executor = make_decode_executor()
+        return _decode_executor
+
+def decode_image(data: bytes, draft_size: Optional[int] = None) -> Optional[Image.Image]:
+    """
+    Decodes image bytes to an RGB PIL.Image, or None if they aren't a readable image.
+    With draft_size, JPEGs are decoded at the smallest 1/2, 1/4 or 1/8 scale that keeps
+    both sides >= draft_size, which is much faster for big photos. Use it only when the
+    result is embedded or thumbnailed, never for images that get exported.
+    """
+    try:
+        image = Image.open(BytesIO(data))
+        if draft_size:
+            # No-op for formats other than JPEG
+            image.draft("RGB", (draft_size, draft_size))
+        return image.convert("RGB")
+    except Exception:
+        return None
+
+async def decode_image_async(data: bytes, draft_size: Optional[int] = None,
+                             executor: Optional[Executor] = None) -> Optional[Image.Image]:
+    """
+    decode_image on an executor so the event loop keeps serving downloads meanwhile.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor or get_decode_executor(), decode_image, data, draft_size)
+
+async def download_image(session: aiohttp.ClientSession, url: str,
+                         draft_size: Optional[int] = None,
+                         executor: Optional[Executor] = None,
+                         cache: Optional[DiskCache] = None) -> Tuple[str, Optional[Image.Image]]:
+    """
+    Downloads a single image and returns (url, PIL.Image object).
+    Returns (url, None) on failure.
+    """
+    url, data = await fetch_image_bytes(session, url, cache)
+    if data is None:
         return url, None
+    return url, await decode_image_async(data, draft_size, executor)
 
-async def download_images_parallel(urls: List[str], max_concurrency: int = 10) -> dict:
+async def download_images_parallel(urls: List[str], max_concurrency: int = 10,
+                                   draft_size: Optional[int] = None,
+                                   executor: Optional[Executor] = None,
+                                   cache: Optional[DiskCache] = None,
+                                   limiter: Optional[HostLimiter] = None,
+                                   retry: RetryPolicy = DEFAULT_RETRY,
+                                   session: Optional[aiohttp.ClientSession] = None,
+                                   limits: DownloadLimits = DEFAULT_LIMITS) -> DownloadReport:
     """
     Downloads multiple images in parallel.
-    Returns a dictionary {url: PIL.Image} for successful downloads.
-    """
-    results = {}
-    connector = aiohttp.TCPConnector(limit=max_concurrency)
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-    }
-    async with aiohttp.ClientSession(connector=connector, headers=headers) as session:
-        tasks = [download_image(session, url) for url in urls]
-        for completed_task in asyncio.as_completed(tasks):
-            url, image = await completed_task
-            if image:
-                results[url] = image
-                
-    return results
+    Returns a DownloadReport: {url: PIL.Image} for successful downloads, and a
+    DownloadFailure with the reason for every other url.
+    At most max_concurrency requests are open overall; within that, each host gets its
+    own adaptive limit (a fresh HostLimiter unless one is passed in), see fetch_image.
+    Responses outside `limits` are rejected before they're fully downloaded or decoded.
+    Decoding runs on `executor` (default: the shared decode pool), see decode_image for draft_size.
+    Pass a DiskCache to reuse bodies from earlier sessions, and a long-lived session
+    (see http_session.SessionManager) to reuse warm connections; otherwise a
+    throwaway one is opened for this call.
+    """
+    report = DownloadReport()
+    limiter = limiter or HostLimiter()
+
+    async def one(session, url: str, slots: Optional[asyncio.Semaphore] = None):
+        data, failure = await fetch_image(session, url, cache, limiter, retry, limits, slots)
+        if failure is not None:
+            report.failures[url] = failure
+            return
+        image = await decode_image_async(data, draft_size, executor)
+        if image is None:
+            report.failures[url] = DownloadFailure(url, "not a decodable image")
+        else:
+            report.images[url] = image
+
+    urls = list(dict.fromkeys(urls))
+    if session is not None:
+        # The shared session's connector is sized for the whole app, cap this call's share
+        slots = asyncio.Semaphore(max_concurrency)
+        await asyncio.gather(*(one(session, url, slots) for url in urls))
+    else:
+        connector = aiohttp.TCPConnector(limit=max_concurrency)
+        async with aiohttp.ClientSession(connector=connector, headers=DEFAULT_HEADERS) as own_session:
+            await asyncio.gather(*(one(own_session, url) for url in urls))
+
+    return report
+
+async def prefetch_images(urls: List[str], cache: DiskCache, max_concurrency: int = 10,
+                          limiter: Optional[HostLimiter] = None,
+                          retry: RetryPolicy = DEFAULT_RETRY,
+                          session: Optional[aiohttp.ClientSession] = None,
+                          limits: DownloadLimits = DEFAULT_LIMITS) -> Dict[str, DownloadFailure]:
+    """
+    Downloads urls into the disk cache without decoding or keeping them, so a later
+    pass (e.g. an export) can read them back one at a time.
+    Returns a DownloadFailure for every url that couldn't be fetched.
+    Concurrency, limiter and session work as in download_images_parallel.
+    """
+    failures: Dict[str, DownloadFailure] = {}
+    limiter = limiter or HostLimiter()
+
+    async def one(session, url: str, slots: Optional[asyncio.Semaphore] = None):
+        _, failure = await fetch_image(session, url, cache, limiter, retry, limits, slots)
+        if failure is not None:
+            failures[url] = failure
+
+    urls = list(dict.fromkeys(urls))
+    if session is not None:
+        slots = asyncio.Semaphore(max_concurrency)
+        await asyncio.gather(*(one(session, url, slots) for url in urls))
+    else:
+        connector = aiohttp.TCPConnector(limit=max_concurrency)
+        async with aiohttp.ClientSession(connector=connector, headers=DEFAULT_HEADERS) as own_session:
+            await asyncio.gather(*(one(own_session, url) for url in urls))
+
+    return failures
@@ -0,0 +1,346 @@
+import dataclasses
+import hashlib
+import io
+import json
+import os
+import tarfile
+from collections import Counter
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from PIL import Image
+
+from src.utils.exporter import (DEFAULT_OPTIONS, DEFAULT_SHARD_BYTES, DEFAULT_SHARD_COUNT, ExportEntry, ExportOptions,
+                                ShardWriter, caption_filename, prepare_entries, sample_files, write_atomic)
+
+MANIFEST_NAME = "export_manifest.json"
+MANIFEST_VERSION = 1
+
+# Hex chars of the content hash used for output names
+NAME_HASH_CHARS = 16
+
+# Save the manifest every this many new items, so an interrupted export resumes close to where it stopped
+CHECKPOINT_EVERY = 100
+
+
+@dataclass
+class SyncResult:
+    added: int = 0
+    removed: int = 0
+    kept: int = 0
+    failed: int = 0
+
+
+def entry_key(entry: ExportEntry) -> str:
+    return entry.key or entry.url or entry.name
+
+
+def source_digest(source) -> Optional[Tuple[str, Any]]:
+    """
+    (sha256 hex, resolved source) for an ImageSource, or None if it's missing.
+    Encoded bytes are hashed as they are; decoded images by their pixels.
+    """
+    if callable(source):
+        source = source()
+    if source is None:
+        return None
+    if isinstance(source, Image.Image):
+        digest = hashlib.sha256(source.mode.encode() + repr(source.size).encode() + source.tobytes())
+    else:
+        digest = hashlib.sha256(source)
+    return digest.hexdigest(), source
+
+
+def export_settings(options: ExportOptions, include_captions: bool) -> Dict[str, Any]:
+    """
+    Everything that changes the bytes written for an item. Outputs made with
+    different settings can't be reused, so a change means a full re-export.
+    """
+    settings = dataclasses.asdict(options)
+    settings["include_captions"] = include_captions
+    # Through JSON so tuples compare equal to the lists read back from disk
+    return json.loads(json.dumps(settings))
+
+
+class ExportManifest:
+    """
+    What an export target (a folder of files or a set of WebDataset shards) already holds.
+
+    Stored as export_manifest.json in the target directory:
+      layout     "files" or "webdataset"
+      settings   export_settings() of the export that wrote the items
+      items      item key -> {"hash", "name", "ext", "caption"[, "shard"]}
+      shards     shard file names, webdataset layout only
+    Output names come from the content hash, not the position in the basket, so
+    items keep their name when others are added or removed, and one image in the
+    basket under two keys is written once.
+    Saved with write-then-rename: after an interruption the manifest lists exactly
+    the items whose files were complete at the last checkpoint.
+    """
+
+    def __init__(self, directory: str, layout: str, settings: Dict[str, Any],
+                 items: Optional[Dict[str, Dict[str, Any]]] = None, shards: Optional[List[str]] = None):
+        self.directory = directory
+        self.layout = layout
+        self.settings = settings
+        self.items: Dict[str, Dict[str, Any]] = items or {}
+        self.shards: List[str] = shards or []
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, MANIFEST_NAME)
+
+    @classmethod
+    def read(cls, directory: str) -> Optional["ExportManifest"]:
+        """
+        The manifest in directory, or None if there is none (or it's unreadable).
+        """
+        try:
+            with open(os.path.join(directory, MANIFEST_NAME), encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != MANIFEST_VERSION:
+            return None
+        return cls(directory, data["layout"], data["settings"], data.get("items"), data.get("shards"))
+
+    def save(self):
+        data = {"version": MANIFEST_VERSION, "layout": self.layout, "settings": self.settings,
+                "items": self.items, "shards": self.shards}
+        write_atomic(self.path, json.dumps(data))
+
+    def name_counts(self) -> Counter:
+        """
+        How many items point at each output name.
+        """
+        return Counter(item["name"] for item in self.items.values())
+
+    def output_files(self) -> List[str]:
+        """
+        Every file the listed items occupy, relative to the directory.
+        """
+        if self.layout == "webdataset":
+            return list(self.shards)
+        files = set()
+        for item in self.items.values():
+            files.add(item["name"])
+            files.add(caption_filename(item["name"]))
+        return sorted(files)
+
+    def remove_outputs(self):
+        for name in self.output_files():
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+        self.items = {}
+        self.shards = []
+
+
+def open_manifest(directory: str, layout: str, settings: Dict[str, Any]) -> ExportManifest:
+    """
+    The manifest to update for an export into directory. If the previous export
+    used another layout or other settings its outputs are removed and the
+    export starts over.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = ExportManifest.read(directory)
+    if manifest is not None and manifest.layout == layout and manifest.settings == settings:
+        return manifest
+    if manifest is not None:
+        print(f"Export settings for {directory} changed, rewriting it from scratch.")
+        manifest.remove_outputs()
+    manifest = ExportManifest(directory, layout, settings)
+    manifest.save()
+    return manifest
+
+
+def _hashed(entries: Iterable[ExportEntry], digests: Dict[str, str]) -> Iterator[ExportEntry]:
+    # Resolves each source once to hash it; the resolved bytes go on to the encoders
+    for entry in entries:
+        resolved = source_digest(entry.source)
+        if resolved is None:
+            yield entry._replace(source=None)
+            continue
+        digest, source = resolved
+        digests[entry_key(entry)] = digest
+        yield entry._replace(source=source)
+
+
+def sync_dataset_dir(entries: Iterable[ExportEntry], directory: str, include_captions: bool = True,
+                     options: ExportOptions = DEFAULT_OPTIONS, executor: Optional[Executor] = None) -> SyncResult:
+    """
+    Makes directory hold exactly entries, as loose image (and caption) files.
+    Items already exported are kept (only their caption is rewritten if it changed),
+    items no longer in entries are deleted, and only new ones are prepared and written.
+    Safe to interrupt: the next call picks up after the last checkpoint.
+    """
+    manifest = open_manifest(directory, "files", export_settings(options, include_captions))
+    result = SyncResult()
+    wanted: Set[str] = set()
+    new: List[ExportEntry] = []
+    for entry in entries:
+        key = entry_key(entry)
+        wanted.add(key)
+        item = manifest.items.get(key)
+        if item is None or not os.path.exists(os.path.join(directory, item["name"])):
+            # Never written, or its file was deleted since: write it again
+            manifest.items.pop(key, None)
+            new.append(entry)
+            continue
+        caption = entry.caption or ""
+        if include_captions and item.get("caption") != caption:
+            write_atomic(os.path.join(directory, caption_filename(item["name"])), caption)
+            item["caption"] = caption
+        result.kept += 1
+
+    in_use = manifest.name_counts()
+    for key in [k for k in manifest.items if k not in wanted]:
+        item = manifest.items.pop(key)
+        result.removed += 1
+        in_use[item["name"]] -= 1
+        if in_use[item["name"]] > 0:
+            continue
+        for name in (item["name"], caption_filename(item["name"])):
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+    manifest.save()
+
+    digests: Dict[str, str] = {}
+    for entry, prepared in prepare_entries(_hashed(new, digests), options, executor):
+        key = entry_key(entry)
+        if prepared is None:
+            result.failed += 1
+            continue
+        data, ext = prepared
+        digest = digests[key]
+        name = f"{digest[:NAME_HASH_CHARS]}.{ext}"
+        if not in_use[name] or not os.path.exists(os.path.join(directory, name)):
+            write_atomic(os.path.join(directory, name), data)
+        in_use[name] += 1
+        if include_captions:
+            write_atomic(os.path.join(directory, caption_filename(name)), entry.caption or "")
+        manifest.items[key] = {"hash": digest, "name": name, "ext": ext, "caption": entry.caption or ""}
+        result.added += 1
+        if result.added % CHECKPOINT_EVERY == 0:
+            manifest.save()
+    manifest.save()
+    return result
+
+
+def rewrite_shard(path: str, drop: Set[str], captions: Dict[str, str]) -> int:
+    """
+    Rewrites the tar shard at path without the samples whose key is in drop, and with
+    new captions (.txt and the json's "caption") for the keys in captions.
+    Returns the number of samples left; an emptied shard is deleted.
+    """
+    tmp = path + ".tmp"
+    keys: Set[str] = set()
+    with tarfile.open(path) as source, tarfile.open(tmp, "w", format=tarfile.USTAR_FORMAT) as target:
+        for info in source:
+            key, ext = info.name.split(".", 1)
+            if key in drop:
+                continue
+            data = source.extractfile(info).read()
+            if key in captions and ext == "txt":
+                data = captions[key].encode("utf-8")
+            elif key in captions and ext == "json":
+                meta = json.loads(data)
+                meta["caption"] = captions[key]
+                data = json.dumps(meta).encode("utf-8")
+            info.size = len(data)
+            target.addfile(info, io.BytesIO(data))
+            keys.add(key)
+    if keys:
+        os.replace(tmp, path)
+    else:
+        os.remove(tmp)
+        os.remove(path)
+    return len(keys)
+
+
+def sync_webdataset(entries: Iterable[ExportEntry], directory: str, include_captions: bool = True,
+                    options: ExportOptions = DEFAULT_OPTIONS, executor: Optional[Executor] = None,
+                    max_shard_bytes: int = DEFAULT_SHARD_BYTES, max_shard_count: int = DEFAULT_SHARD_COUNT,
+                    prefix: str = "") -> SyncResult:
+    """
+    sync_dataset_dir for a WebDataset shard set (see write_webdataset).
+    Shards that lost items or whose captions changed are rewritten in place, new
+    items go into new shards after the existing ones; untouched shards aren't
+    opened. Sample keys are content hashes, so they stay the same across updates.
+    Items are recorded in the manifest once their shard is complete.
+    """
+    manifest = open_manifest(directory, "webdataset", export_settings(options, include_captions))
+    result = SyncResult()
+    wanted: Set[str] = set()
+    new: List[ExportEntry] = []
+    recaption: Dict[str, Dict[str, str]] = {}
+    for entry in entries:
+        key = entry_key(entry)
+        wanted.add(key)
+        item = manifest.items.get(key)
+        if item is None or not os.path.exists(os.path.join(directory, item["shard"])):
+            manifest.items.pop(key, None)
+            new.append(entry)
+            continue
+        caption = entry.caption or ""
+        if item.get("caption") != caption:
+            recaption.setdefault(item["shard"], {})[item["name"]] = caption
+            item["caption"] = caption
+        result.kept += 1
+
+    drop: Dict[str, Set[str]] = {}
+    in_use = manifest.name_counts()
+    for key in [k for k in manifest.items if k not in wanted]:
+        item = manifest.items.pop(key)
+        result.removed += 1
+        in_use[item["name"]] -= 1
+        if in_use[item["name"]] <= 0:
+            drop.setdefault(item["shard"], set()).add(item["name"])
+    for shard in sorted(set(drop) | set(recaption)):
+        path = os.path.join(directory, shard)
+        if os.path.exists(path) and not rewrite_shard(path, drop.get(shard, set()), recaption.get(shard, {})):
+            manifest.shards.remove(shard)
+    manifest.save()
+
+    # Samples already in the set under another key are shared, not written twice
+    shard_of = {item["name"]: item["shard"] for item in manifest.items.values()}
+    next_shard = max((int(name[len(prefix):-len(".tar")]) for name in manifest.shards), default=-1) + 1
+    digests: Dict[str, str] = {}
+    pending: List[Tuple[str, Dict[str, Any], str]] = []
+
+    def record(finished: List[str]):
+        done = {os.path.basename(path) for path in finished}
+        for key, item, shard in [p for p in pending if p[2] in done]:
+            manifest.items[key] = item
+        pending[:] = [p for p in pending if p[2] not in done]
+        manifest.shards.extend(sorted(done - set(manifest.shards)))
+        manifest.save()
+
+    with ShardWriter(directory, prefix, max_shard_bytes, max_shard_count, start_shard=next_shard) as shards:
+        for entry, prepared in prepare_entries(_hashed(new, digests), options, executor):
+            key = entry_key(entry)
+            if prepared is None:
+                result.failed += 1
+                continue
+            data, ext = prepared
+            digest = digests[key]
+            name = digest[:NAME_HASH_CHARS]
+            item = {"hash": digest, "name": name, "ext": ext, "caption": entry.caption or ""}
+            if name in shard_of:
+                item["shard"] = shard_of[name]
+                manifest.items[key] = item
+            else:
+                finished = len(shards.shards)
+                shards.write(name, sample_files(entry, data, ext, include_captions))
+                item["shard"] = os.path.basename(shards.current_path)
+                shard_of[name] = item["shard"]
+                pending.append((key, item, item["shard"]))
+                if len(shards.shards) > finished:
+                    record(shards.shards)
+            result.added += 1
+    record(shards.shards)
+    return result
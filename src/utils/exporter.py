@@ -1,7 +1,518 @@
+import importlib.util
 import io
+import json
+import math
+import os
+import tarfile
 import zipfile
-from PIL import Image
-from typing import List, Dict, Optional
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from dataclasses import dataclass
+import numpy as np
+from PIL import Image, ImageOps
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+# An image, its encoded file bytes, or a callable producing either lazily (None = skip)
+ImageSource = Union[Image.Image, bytes, Callable[[], Union[Image.Image, bytes, None]]]
+
+# Formats written as-is in pass-through mode, with the extension they get
+PASSTHROUGH_FORMATS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp"}
+
+CROP_POLICIES = ("none", "center", "bucket")
+
+# Aspect ratios (w, h) for bucketed crops, the usual set for training at mixed aspect ratios
+DEFAULT_BUCKETS = ((1, 1), (4, 3), (3, 4), (3, 2), (2, 3), (16, 9), (9, 16))
+
+# WebDataset shards are closed at whichever comes first
+DEFAULT_SHARD_BYTES = 1024 ** 3
+DEFAULT_SHARD_COUNT = 10000
+
+class ExportEntry(NamedTuple):
+    name: str
+    source: ImageSource
+    caption: Optional[str] = None
+    url: Optional[str] = None
+    embedding: Optional[np.ndarray] = None
+    # Identity of the item across exports (url or local id), for incremental exports
+    key: Optional[str] = None
+    # (width, height) of the original as reported by the site, when known
+    source_size: Optional[Tuple[int, int]] = None
+
+@dataclass(frozen=True)
+class ExportOptions:
+    """
+    How images are written.
+    target_size: None keeps the resolution. With crop "none" images are scaled down to
+        fit in target_size x target_size; "center" crops the middle square and scales it
+        to target_size; "bucket" crops to the closest aspect ratio in buckets at about
+        target_size^2 pixels, sides rounded to multiples of bucket_multiple.
+    format: "JPEG", "PNG" or "WEBP"; None keeps the source format when it's one of those.
+    passthrough: write the untouched source bytes when there's nothing to convert.
+    """
+    target_size: Optional[int] = None
+    crop: str = "none"
+    format: Optional[str] = None
+    quality: int = 95
+    buckets: Tuple[Tuple[int, int], ...] = DEFAULT_BUCKETS
+    bucket_multiple: int = 64
+    passthrough: bool = True
+
+    def __post_init__(self):
+        if self.crop not in CROP_POLICIES:
+            raise ValueError(f"Unknown crop policy {self.crop!r}, expected one of {CROP_POLICIES}.")
+        if self.format is not None and self.format not in PASSTHROUGH_FORMATS:
+            raise ValueError(f"Unsupported export format {self.format!r}, expected one of {tuple(PASSTHROUGH_FORMATS)}.")
+
+    @property
+    def converts(self) -> bool:
+        return self.target_size is not None or self.crop != "none" or self.format is not None
+
+DEFAULT_OPTIONS = ExportOptions()
+
+def load_source(source: ImageSource) -> Optional[Image.Image]:
+    """
+    Resolves an ImageSource to a PIL.Image, or None if it's missing or unreadable.
+    """
+    if callable(source):
+        source = source()
+    if source is None:
+        return None
+    if isinstance(source, Image.Image):
+        return source
+    try:
+        return Image.open(io.BytesIO(source))
+    except Exception:
+        return None
+
+def flatten_alpha(img: Image.Image, background=(255, 255, 255)) -> Image.Image:
+    """
+    img without transparency: transparent areas are composited on background.
+    """
+    if img.mode == "P":
+        img = img.convert("RGBA")
+    if img.mode in ("RGBA", "LA"):
+        canvas = Image.new("RGB", img.size, background)
+        canvas.paste(img.convert("RGB"), mask=img.getchannel("A"))
+        return canvas
+    return img if img.mode in ("RGB", "L") else img.convert("RGB")
+
+def encode_output(img: Image.Image, fmt: str = "JPEG", quality: int = 95) -> bytes:
+    buffer = io.BytesIO()
+    if fmt == "JPEG":
+        # JPEG has no alpha channel, flatten instead of letting it go black
+        flatten_alpha(img).save(buffer, format="JPEG", quality=quality)
+    elif fmt == "WEBP":
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if img.mode in ("LA", "P", "PA") else "RGB")
+        img.save(buffer, format="WEBP", quality=quality)
+    else:
+        if img.mode not in ("1", "L", "LA", "P", "RGB", "RGBA"):
+            img = img.convert("RGB")
+        img.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+def encode_jpeg(img: Image.Image) -> bytes:
+    return encode_output(img, "JPEG", 95)
+
+def sniff_format(data: bytes) -> Optional[str]:
+    """
+    Pillow's format name ("JPEG", "PNG", ...) from the file header, without decoding.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return img.format
+    except Exception:
+        return None
+
+def bucket_size(width: int, height: int, target: int, buckets: Sequence[Tuple[int, int]] = DEFAULT_BUCKETS,
+                multiple: int = 64) -> Tuple[int, int]:
+    """
+    Output size of a bucketed crop: the bucket closest in aspect ratio (compared in log
+    space, so 2:1 and 1:2 are equally far from 1:1), scaled to about target^2 pixels.
+    """
+    aspect = width / height
+    bw, bh = min(buckets, key=lambda b: abs(math.log(aspect * b[1] / b[0])))
+    h = target * math.sqrt(bh / bw)
+    w = h * bw / bh
+    return max(multiple, round(w / multiple) * multiple), max(multiple, round(h / multiple) * multiple)
+
+def resize_image(img: Image.Image, options: ExportOptions) -> Image.Image:
+    """
+    Applies options' crop policy and target size.
+    """
+    # Crop what the viewer sees, not how the camera stored it
+    img = ImageOps.exif_transpose(img)
+    if options.crop == "center":
+        side = options.target_size or min(img.size)
+        return ImageOps.fit(img, (side, side), Image.LANCZOS)
+    if options.crop == "bucket":
+        target = options.target_size or int(math.sqrt(img.size[0] * img.size[1]))
+        size = bucket_size(img.size[0], img.size[1], target, options.buckets, options.bucket_multiple)
+        return ImageOps.fit(img, size, Image.LANCZOS)
+    if options.target_size is not None and max(img.size) > options.target_size:
+        img = img.copy()
+        img.thumbnail((options.target_size, options.target_size), Image.LANCZOS)
+    return img
+
+def prepare_image(source: ImageSource, options: ExportOptions = DEFAULT_OPTIONS) -> Optional[Tuple[bytes, str]]:
+    """
+    (file bytes, extension) to write for a source, or None to skip it.
+    With options.passthrough and nothing to convert, encoded bytes in an accepted format
+    are returned untouched: no decode, no generation loss. Everything else is resized
+    and cropped per options, then encoded (as JPEG when no format is asked for and the
+    image is kept as is).
+    Safe to run on make_export_executor's pool.
+    """
+    if callable(source):
+        source = source()
+    if source is None:
+        return None
+    source_format = None
+    if isinstance(source, bytes):
+        source_format = sniff_format(source)
+        if options.passthrough and not options.converts and source_format in PASSTHROUGH_FORMATS:
+            return source, PASSTHROUGH_FORMATS[source_format]
+    img = load_source(source)
+    if img is None:
+        return None
+    source_format = source_format or img.format
+    if options.format is not None:
+        fmt = options.format
+    elif options.converts and source_format in PASSTHROUGH_FORMATS:
+        fmt = source_format
+    else:
+        fmt = "JPEG"
+    try:
+        if options.target_size is not None or options.crop != "none":
+            img = resize_image(img, options)
+        return encode_output(img, fmt, options.quality), PASSTHROUGH_FORMATS[fmt]
+    except Exception:
+        # Truncated files only fail here, when the pixels are first decoded
+        return None
+
+def make_export_executor(max_workers: Optional[int] = None) -> Executor:
+    """
+    Thread pool for prepare_image, one worker per core by default.
+    Pillow releases the GIL while it decodes, resizes and encodes, so threads keep
+    every core busy. Worker processes would not be safe here: a spawned child re-runs
+    the __main__ script, which under Streamlit is the whole app (browser install,
+    model load, caches).
+    """
+    return ThreadPoolExecutor(max_workers=max_workers or os.cpu_count(), thread_name_prefix="export")
+
+def prepare_entries(entries: Iterable[ExportEntry], options: ExportOptions = DEFAULT_OPTIONS,
+                    executor: Optional[Executor] = None,
+                    window: int = 64) -> Iterator[Tuple[ExportEntry, Optional[Tuple[bytes, str]]]]:
+    """
+    Yields (entry, prepare_image result) in entry order.
+    Sources are resolved in the calling thread and prepared on executor with up to
+    `window` images in flight, so every worker stays busy while the caller (the only
+    writer) appends results in a deterministic order.
+    Without an executor, or with nothing to convert, images are prepared inline.
+    """
+    if executor is None or (options.passthrough and not options.converts):
+        for entry in entries:
+            yield entry, prepare_image(entry.source, options)
+        return
+
+    pending = deque()
+    for entry in entries:
+        source = entry.source() if callable(entry.source) else entry.source
+        if source is None:
+            future = Future()
+            future.set_result(None)
+        else:
+            future = executor.submit(prepare_image, source, options)
+        pending.append((entry, future))
+        if len(pending) >= window:
+            done, future = pending.popleft()
+            yield done, future.result()
+    while pending:
+        done, future = pending.popleft()
+        yield done, future.result()
+
+def with_extension(filename: str, ext: str) -> str:
+    return filename.rsplit(".", 1)[0] + "." + ext
+
+def caption_filename(filename: str) -> str:
+    return with_extension(filename, "txt")
+
+def write_dataset_zip(entries: Iterable[ExportEntry], target: Union[str, IO[bytes]],
+                      include_captions: bool = True, options: ExportOptions = DEFAULT_OPTIONS,
+                      executor: Optional[Executor] = None) -> int:
+    """
+    Writes entries into a zip at target (a path or a writable binary file), in order:
+    only the images in flight are ever held, so memory doesn't grow with the dataset.
+    See prepare_image for options and prepare_entries for executor; the entry's
+    extension is adjusted to what's written.
+    Images are STORED (they're compressed already, DEFLATE would only burn CPU),
+    captions are DEFLATEd. Entries whose source is missing or unreadable are skipped.
+    Returns the number of images written.
+    """
+    written = 0
+    with zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for entry, prepared in prepare_entries(entries, options, executor):
+            if prepared is None:
+                continue
+            data, ext = prepared
+            name = with_extension(entry.name, ext)
+            zip_file.writestr(name, data, compress_type=zipfile.ZIP_STORED)
+            if include_captions:
+                zip_file.writestr(caption_filename(name), entry.caption or "")
+            written += 1
+    return written
+
+def write_atomic(path: str, data: Union[bytes, str]):
+    # Write-then-rename so an interrupted export never leaves half a file behind
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data.encode("utf-8") if isinstance(data, str) else data)
+    os.replace(tmp, path)
+
+def write_dataset_dir(entries: Iterable[ExportEntry], directory: str, include_captions: bool = True,
+                      options: ExportOptions = DEFAULT_OPTIONS, executor: Optional[Executor] = None) -> int:
+    """
+    Same as write_dataset_zip, but as loose files in directory (created if needed).
+    """
+    os.makedirs(directory, exist_ok=True)
+    written = 0
+    for entry, prepared in prepare_entries(entries, options, executor):
+        if prepared is None:
+            continue
+        data, ext = prepared
+        name = with_extension(entry.name, ext)
+        write_atomic(os.path.join(directory, name), data)
+        if include_captions:
+            write_atomic(os.path.join(directory, caption_filename(name)), entry.caption or "")
+        written += 1
+    return written
+
+def image_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """
+    (width, height) of encoded image bytes, read from the header.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return img.size
+    except Exception:
+        return None
+
+def sample_metadata(entry: ExportEntry, data: bytes, ext: str) -> Dict[str, Any]:
+    width, height = image_size(data) or (None, None)
+    source_width, source_height = entry.source_size or (None, None)
+    return {"name": entry.name, "caption": entry.caption or "", "url": entry.url,
+            "width": width, "height": height, "format": ext,
+            "source_width": source_width, "source_height": source_height}
+
+class ShardWriter:
+    """
+    Writes samples into numbered tar shards (<prefix>000000.tar, <prefix>000001.tar, ...)
+    in WebDataset layout: the files of one sample are consecutive members sharing a key.
+    A shard is closed once it holds max_count samples or max_bytes of data, so
+    loaders can read shards in parallel. Shards are written under a temporary name
+    and renamed when complete; members get a fixed mtime so the same samples always
+    produce the same bytes.
+    """
+
+    def __init__(self, directory: str, prefix: str = "", max_bytes: int = DEFAULT_SHARD_BYTES,
+                 max_count: int = DEFAULT_SHARD_COUNT, start_shard: int = 0):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_count = max_count
+        self.shards: List[str] = []
+        self._next_shard = start_shard
+        self._tar: Optional[tarfile.TarFile] = None
+        self._path = None
+        self._bytes = 0
+        self._count = 0
+
+    @property
+    def current_path(self) -> Optional[str]:
+        """
+        Final path of the shard being written, None between shards.
+        """
+        return self._path if self._tar is not None else None
+
+    def shard_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{self.prefix}{number:06d}.tar")
+
+    def _open(self):
+        self._path = self.shard_path(self._next_shard)
+        self._next_shard += 1
+        self._tar = tarfile.open(self._path + ".tmp", "w", format=tarfile.USTAR_FORMAT)
+        self._bytes = self._count = 0
+
+    def _finish(self):
+        if self._tar is None:
+            return
+        self._tar.close()
+        os.replace(self._path + ".tmp", self._path)
+        self.shards.append(self._path)
+        self._tar = None
+
+    def write(self, key: str, files: Dict[str, bytes]):
+        """
+        Adds one sample: files maps extensions ("jpg", "txt", "json") to contents.
+        """
+        size = sum(len(data) for data in files.values())
+        if self._tar is not None and (self._count >= self.max_count or
+                                      (self._count and self._bytes + size > self.max_bytes)):
+            self._finish()
+        if self._tar is None:
+            self._open()
+        for ext, data in files.items():
+            info = tarfile.TarInfo(f"{key}.{ext}")
+            info.size = len(data)
+            info.mode = 0o644
+            self._tar.addfile(info, io.BytesIO(data))
+        self._bytes += size
+        self._count += 1
+
+    def close(self) -> List[str]:
+        """
+        Finishes the open shard. Returns the paths of all shards written.
+        """
+        self._finish()
+        return self.shards
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self._tar is not None:
+            # Don't leave a half-written shard that looks complete
+            self._tar.close()
+            os.remove(self._path + ".tmp")
+            self._tar = None
+
+def _npy_bytes(array: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, np.asarray(array, dtype=np.float32))
+    return buffer.getvalue()
+
+def sample_files(entry: ExportEntry, data: bytes, ext: str, include_captions: bool = True) -> Dict[str, bytes]:
+    """
+    The files of one WebDataset sample, by extension.
+    """
+    files = {ext: data}
+    if include_captions:
+        files["txt"] = (entry.caption or "").encode("utf-8")
+    files["json"] = json.dumps(sample_metadata(entry, data, ext)).encode("utf-8")
+    if entry.embedding is not None:
+        files["npy"] = _npy_bytes(entry.embedding)
+    return files
+
+def write_webdataset(entries: Iterable[ExportEntry], directory: str, include_captions: bool = True,
+                     options: ExportOptions = DEFAULT_OPTIONS, executor: Optional[Executor] = None,
+                     max_shard_bytes: int = DEFAULT_SHARD_BYTES, max_shard_count: int = DEFAULT_SHARD_COUNT,
+                     prefix: str = "") -> int:
+    """
+    Writes entries as WebDataset tar shards in directory, streaming like write_dataset_zip.
+    Each sample is 000000.jpg (or .png/.webp), 000000.txt with the caption,
+    000000.json with name, caption, url and dimensions (also the original's, when
+    known), and 000000.npy with the embedding when the entry has one. Keys count up
+    across shards.
+    Returns the number of samples written.
+    """
+    written = 0
+    with ShardWriter(directory, prefix, max_shard_bytes, max_shard_count) as shards:
+        for entry, prepared in prepare_entries(entries, options, executor):
+            if prepared is None:
+                continue
+            data, ext = prepared
+            shards.write(f"{written:06d}", sample_files(entry, data, ext, include_captions))
+            written += 1
+    return written
+
+def parquet_available() -> bool:
+    """
+    Whether write_parquet can run here (pyarrow is an optional dependency).
+    """
+    return importlib.util.find_spec("pyarrow") is not None
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("Parquet export needs pyarrow (pip install pyarrow).") from e
+    return pyarrow, pyarrow.parquet
+
+def parquet_schema(pa, inline_images: bool = True):
+    return pa.schema([
+        ("name", pa.string()),
+        ("image", pa.binary()) if inline_images else ("path", pa.string()),
+        ("format", pa.string()),
+        ("caption", pa.string()),
+        ("url", pa.string()),
+        ("width", pa.int32()),
+        ("height", pa.int32()),
+        ("source_width", pa.int32()),
+        ("source_height", pa.int32()),
+        ("embedding", pa.list_(pa.float32())),
+    ])
+
+def write_parquet(entries: Iterable[ExportEntry], path: str, options: ExportOptions = DEFAULT_OPTIONS,
+                  executor: Optional[Executor] = None, image_dir: Optional[str] = None,
+                  row_group_size: int = 1000, row_group_bytes: int = 64 * 1024 * 1024) -> int:
+    """
+    Writes entries as a Parquet table at path, one row per image: name, the image
+    bytes (or, with image_dir, the path of the file written there, relative to path's
+    folder), format, caption, url, width, height, source_width, source_height and embedding.
+    Rows are flushed as a row group every row_group_size rows or row_group_bytes of
+    image data, so memory stays bounded and loaders can split the file by row group.
+    Needs pyarrow, imported on first use. Returns the number of rows written.
+    """
+    pa, pq = _require_pyarrow()
+    schema = parquet_schema(pa, inline_images=image_dir is None)
+    if image_dir is not None:
+        os.makedirs(image_dir, exist_ok=True)
+    base = os.path.dirname(os.path.abspath(path))
+    columns: Dict[str, list] = {name: [] for name in schema.names}
+    buffered = 0
+    written = 0
+
+    def flush():
+        if columns["name"]:
+            writer.write_table(pa.table(columns, schema=schema))
+            for values in columns.values():
+                values.clear()
+
+    tmp = path + ".tmp"
+    writer = pq.ParquetWriter(tmp, schema)
+    try:
+        for entry, prepared in prepare_entries(entries, options, executor):
+            if prepared is None:
+                continue
+            data, ext = prepared
+            meta = sample_metadata(entry, data, ext)
+            if image_dir is None:
+                columns["image"].append(data)
+                buffered += len(data)
+            else:
+                file_path = os.path.join(image_dir, with_extension(entry.name, ext))
+                write_atomic(file_path, data)
+                columns["path"].append(os.path.relpath(file_path, base))
+            for key in ("name", "format", "caption", "url", "width", "height", "source_width", "source_height"):
+                columns[key].append(meta[key])
+            columns["embedding"].append(None if entry.embedding is None
+                                        else np.asarray(entry.embedding, dtype=np.float32).tolist())
+            written += 1
+            if len(columns["name"]) >= row_group_size or buffered >= row_group_bytes:
+                flush()
+                buffered = 0
+        flush()
+    except BaseException:
+        writer.close()
+        os.remove(tmp)
+        raise
+    writer.close()
+    os.replace(tmp, path)
+    return written
 
 def create_dataset_zip(images: Dict[str, Image.Image], captions: Dict[str, str], include_captions: bool = True) -> io.BytesIO:
     """
@@ -9,28 +520,13 @@ def create_dataset_zip(images: Dict[str, Image.Image], captions: Dict[str, str],
     images: {filename: PIL.Image}
     captions: {filename: caption_text}
     include_captions: If True, includes .txt files with captions.
+    For big datasets use write_dataset_zip with a file target instead.
     """
     zip_buffer = io.BytesIO()
-    
-    with zipfile.ZipFile(zip_buffer, "a", zipfile.ZIP_DEFLATED, False) as zip_file:
-        for filename, img in images.items():
-            # Save Image
-            img_byte_arr = io.BytesIO()
-            # Convert to RGB to avoid alpha channel issues with JPEG
-            if img.mode in ("RGBA", "P"):
-                img = img.convert("RGB")
-            
-            img.save(img_byte_arr, format="JPEG", quality=95)
-            zip_file.writestr(filename, img_byte_arr.getvalue())
-            
-            # Save Caption
-            if include_captions:
-                txt_filename = filename.rsplit(".", 1)[0] + ".txt"
-                caption = captions.get(filename, "")
-                zip_file.writestr(txt_filename, caption)
-            
+    entries = (ExportEntry(filename, img, captions.get(filename, "")) for filename, img in images.items())
+    write_dataset_zip(entries, zip_buffer, include_captions)
     zip_buffer.seek(0)
     return zip_buffer
 
-def generate_filename(index: int, prefix: str = "image") -> str:
-    return f"{prefix}_{index:05d}.jpg"
+def generate_filename(index: int, prefix: str = "image", ext: str = "jpg") -> str:
+    return f"{prefix}_{index:05d}.{ext}"
@@ -0,0 +1,239 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from src.ai.embedding_store import DEFAULT_CACHE_DIR
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+DEFAULT_FRESH_FOR = 24 * 3600
+
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+@dataclass
+class CacheEntry:
+    url: str
+    hash: str
+    size: int
+    etag: Optional[str]
+    last_modified: Optional[str]
+    expires_at: float
+
+    @property
+    def fresh(self) -> bool:
+        return time.time() < self.expires_at
+
+
+class DiskCache:
+    """
+    Persistent cache of raw HTTP response bodies.
+
+    Layout on disk:
+      index.sqlite   url -> (content hash, ETag, Last-Modified, expiry), blob sizes and access times
+      objects/ab/<sha256>   the bytes, stored once per distinct content
+
+    Bodies are content-addressed, so the same image served under several URLs
+    (CDN variants, re-scrapes with tracking params) takes space once.
+    When the total size goes over max_bytes the least recently used blobs are
+    deleted together with every url pointing at them, except blobs of pinned
+    entries. Pins only last for the life of the process (they're cleared on open),
+    they're meant for session data spilled here that has no other copy.
+    Entries stay fresh for the response's max-age, or fresh_for seconds without one;
+    stale entries are revalidated with a conditional GET (see downloader.fetch_image_bytes).
+    Safe to share between threads of one process.
+    """
+
+    def __init__(self, root: str = os.path.join(DEFAULT_CACHE_DIR, "http"),
+                 max_bytes: int = DEFAULT_MAX_BYTES, fresh_for: float = DEFAULT_FRESH_FOR):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.fresh_for = fresh_for
+        self._objects = os.path.join(root, "objects")
+        os.makedirs(self._objects, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(root, "index.sqlite"), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS entries (
+                url TEXT PRIMARY KEY,
+                hash TEXT NOT NULL REFERENCES blobs(hash),
+                etag TEXT,
+                last_modified TEXT,
+                expires_at REAL NOT NULL,
+                pinned INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS entries_hash ON entries(hash);
+            CREATE INDEX IF NOT EXISTS blobs_access ON blobs(last_access);
+        """)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(entries)")}
+        if "pinned" not in columns:
+            self._db.execute("ALTER TABLE entries ADD COLUMN pinned INTEGER NOT NULL DEFAULT 0")
+        self._db.execute("UPDATE entries SET pinned = 0 WHERE pinned")
+        self._total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self._objects, digest[:2], digest)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def __contains__(self, url: str) -> bool:
+        return self.lookup(url) is not None
+
+    def lookup(self, url: str) -> Optional[CacheEntry]:
+        """
+        Metadata for url, or None if it isn't cached. Doesn't count as an access.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT e.hash, b.size, e.etag, e.last_modified, e.expires_at "
+                "FROM entries e JOIN blobs b ON b.hash = e.hash WHERE e.url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        return CacheEntry(url, *row)
+
+    def read(self, entry: CacheEntry) -> Optional[bytes]:
+        """
+        The cached body for entry, or None if the blob is gone (the entry is dropped then).
+        """
+        try:
+            with open(self._blob_path(entry.hash), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            self._drop_blob(entry.hash)
+            return None
+        with self._lock:
+            self._db.execute("UPDATE blobs SET last_access = ? WHERE hash = ?", (time.time(), entry.hash))
+        return data
+
+    def get(self, url: str) -> Optional[bytes]:
+        """
+        Cached body for url regardless of freshness, or None.
+        """
+        entry = self.lookup(url)
+        return self.read(entry) if entry is not None else None
+
+    def _expiry(self, cache_control: Optional[str]) -> float:
+        match = _MAX_AGE_RE.search(cache_control or "")
+        return time.time() + (int(match.group(1)) if match else self.fresh_for)
+
+    def put(self, url: str, data: bytes, etag: Optional[str] = None,
+            last_modified: Optional[str] = None, cache_control: Optional[str] = None,
+            pinned: bool = False) -> Optional[str]:
+        """
+        Stores a 200 response body (or any other bytes) for url. Returns its content hash,
+        or None if the response asked not to be stored.
+        Pinned entries are never evicted, see the class docstring.
+        """
+        if cache_control and "no-store" in cache_control:
+            return None
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            # Write-then-rename so readers never see a partial blob
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                inserted = self._db.execute(
+                    "INSERT OR IGNORE INTO blobs (hash, size, last_access) VALUES (?, ?, ?)",
+                    (digest, len(data), now)).rowcount
+                if not inserted:
+                    self._db.execute("UPDATE blobs SET last_access = ? WHERE hash = ?", (now, digest))
+                self._db.execute(
+                    "INSERT OR REPLACE INTO entries (url, hash, etag, last_modified, expires_at, pinned) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (url, digest, etag, last_modified, self._expiry(cache_control), int(pinned)))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            if inserted:
+                self._total += len(data)
+        self._evict()
+        return digest
+
+    def revalidated(self, url: str, cache_control: Optional[str] = None):
+        """
+        The server answered 304 Not Modified: the cached body is fresh again.
+        """
+        with self._lock:
+            self._db.execute("UPDATE entries SET expires_at = ? WHERE url = ?", (self._expiry(cache_control), url))
+
+    def discard(self, url: str):
+        """
+        Forgets url. Its blob goes too unless another url still points at it.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT hash FROM entries WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return
+            self._db.execute("DELETE FROM entries WHERE url = ?", (url,))
+            shared = self._db.execute("SELECT 1 FROM entries WHERE hash = ? LIMIT 1", (row[0],)).fetchone()
+        if not shared:
+            self._drop_blob(row[0])
+
+    def _drop_blob(self, digest: str):
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.execute("DELETE FROM entries WHERE hash = ?", (digest,))
+            size = self._db.execute("SELECT size FROM blobs WHERE hash = ?", (digest,)).fetchone()
+            self._db.execute("DELETE FROM blobs WHERE hash = ?", (digest,))
+            self._db.execute("COMMIT")
+            if size:
+                self._total -= size[0]
+        try:
+            os.remove(self._blob_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        # Down to 90% so we don't evict again on every put once full
+        target = int(self.max_bytes * 0.9)
+        if self._total <= self.max_bytes:
+            return
+        with self._lock:
+            victims = []
+            freed = 0
+            for digest, size in self._db.execute(
+                    "SELECT hash, size FROM blobs WHERE hash NOT IN (SELECT hash FROM entries WHERE pinned) "
+                    "ORDER BY last_access"):
+                if self._total - freed <= target:
+                    break
+                victims.append(digest)
+                freed += size
+        for digest in victims:
+            self._drop_blob(digest)
+
+    def clear(self):
+        with self._lock:
+            digests = [r[0] for r in self._db.execute("SELECT hash FROM blobs")]
+        for digest in digests:
+            self._drop_blob(digest)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
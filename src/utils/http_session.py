@@ -0,0 +1,125 @@
+import asyncio
+import atexit
+import threading
+from typing import AsyncIterator, Awaitable, Iterator, Optional, TypeVar
+
+import aiohttp
+
+from src.utils.downloader import DEFAULT_HEADERS
+from src.utils.throttle import HostLimiter
+
+T = TypeVar("T")
+
+
+async def _anext(agen: AsyncIterator[T]) -> T:
+    # run_coroutine_threadsafe wants a real coroutine, not the awaitable __anext__ returns
+    return await agen.__anext__()
+
+
+class SessionManager:
+    """
+    One long-lived HTTP session on its own event loop thread.
+
+    Every download goes through the same connection pool, so keep-alive connections,
+    resolved DNS entries, TLS sessions and the learned per-host limits (see
+    throttle.HostLimiter) carry over from one batch to the next instead of being
+    thrown away with a per-call ClientSession.
+    Coroutines using the session must run on this manager's loop: use run() for a
+    single result or iterate() for an async generator, from any thread.
+    """
+
+    def __init__(self, limit: int = 64, limit_per_host: int = 0, ttl_dns_cache: int = 300,
+                 keepalive_timeout: float = 60.0, headers: Optional[dict] = None):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.ttl_dns_cache = ttl_dns_cache
+        self.keepalive_timeout = keepalive_timeout
+        self.headers = headers or DEFAULT_HEADERS
+        self.limiter = HostLimiter()
+
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._session = None
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="http-session", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.ttl_dns_cache,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, headers=self.headers)
+        return self._session
+
+    @property
+    def session(self):
+        """
+        The shared session, created on first use. Only use it on self.loop.
+        """
+        return self.run(self._get_session())
+
+    def run(self, coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+        """
+        Runs coro on the manager's loop and blocks until it's done.
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def iterate(self, agen: AsyncIterator[T]) -> Iterator[T]:
+        """
+        Consumes an async generator running on the manager's loop, one item at a time,
+        so the caller's thread can do its own work (e.g. update the UI) in between.
+        Stopping early closes the generator.
+        """
+        try:
+            while True:
+                try:
+                    yield self.run(_anext(agen))
+                except StopAsyncIteration:
+                    return
+        finally:
+            if hasattr(agen, "aclose"):
+                self.run(agen.aclose())
+
+    def close(self):
+        with self._lock:
+            loop = self._loop
+            self._loop = None
+        if loop is None:
+            return
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), loop).result(10)
+            self._session = None
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(timeout=10)
+
+
+_shared_manager: Optional[SessionManager] = None
+_shared_lock = threading.Lock()
+
+
+def get_session_manager() -> SessionManager:
+    """
+    Process-wide session manager.
+    """
+    global _shared_manager
+    with _shared_lock:
+        if _shared_manager is None:
+            _shared_manager = SessionManager()
+            atexit.register(_shared_manager.close)
+        return _shared_manager
@@ -0,0 +1,136 @@
+from collections import OrderedDict
+from io import BytesIO
+from typing import Iterator, Optional, Set
+
+from PIL import Image
+
+from src.utils.http_cache import DiskCache
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def encode_image(image: Image.Image) -> bytes:
+    """
+    Compressed bytes for an image we only have decoded: its own format if Pillow
+    knows it, otherwise PNG (lossless, keeps alpha).
+    """
+    fmt = image.format if image.format in ("JPEG", "PNG", "WEBP") else "PNG"
+    buffer = BytesIO()
+    if fmt == "JPEG":
+        image.convert("RGB").save(buffer, format=fmt, quality=95)
+    else:
+        image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+class ImageCache:
+    """
+    Session image store with a byte budget.
+
+    Keeps the compressed file bytes (a few hundred KB per photo instead of tens of MB
+    of decoded pixels) and only decodes on get(). When the budget is exceeded the
+    least recently used entries move to the disk cache, from where get() brings them
+    back transparently. Local imports ("local::" keys) have no other copy, so they're
+    pinned there; downloaded images are usually in the disk cache already and the
+    spill is just a dedup by content hash.
+    Membership only looks at memory and at the keys this cache spilled itself, never
+    at what else the disk cache holds; get_bytes() does read anything stored there.
+    Not thread-safe, one instance per Streamlit session; get_bytes(admit=False) may
+    run on pipeline threads while the session waits for them (see download_and_embed).
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, spill: Optional[DiskCache] = None):
+        self.max_bytes = max_bytes
+        self.spill = spill
+        self._data: "OrderedDict[str, bytes]" = OrderedDict()
+        self._spilled: Set[str] = set()
+        self._bytes = 0
+
+    @property
+    def total_bytes(self) -> int:
+        """
+        Bytes held in memory (spilled entries don't count).
+        """
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._data))
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._data or key in self._spilled
+
+    def put_bytes(self, key: str, data: bytes):
+        old = self._data.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old)
+        self._data[key] = data
+        self._bytes += len(data)
+        self._spilled.discard(key)
+        self._evict()
+
+    def put_image(self, key: str, image: Image.Image):
+        self.put_bytes(key, encode_image(image))
+
+    def get_bytes(self, key: str, admit: bool = True) -> Optional[bytes]:
+        """
+        The stored file bytes for key. admit=False reads spilled entries without
+        pulling them back into memory, for one-off passes over many images.
+        """
+        data = self._data.get(key)
+        if data is not None:
+            self._data.move_to_end(key)
+            return data
+        if self.spill is None:
+            return None
+        data = self.spill.get(key)
+        if data is None:
+            # Evicted from the disk cache since we spilled it
+            self._spilled.discard(key)
+        elif admit:
+            self.put_bytes(key, data)
+        return data
+
+    def get(self, key: str) -> Optional[Image.Image]:
+        """
+        The decoded image for key, or None if it's unknown or can't be decoded.
+        """
+        data = self.get_bytes(key)
+        if data is None:
+            return None
+        try:
+            image = Image.open(BytesIO(data))
+            image.load()
+            return image
+        except Exception:
+            return None
+
+    def __getitem__(self, key: str) -> Image.Image:
+        image = self.get(key)
+        if image is None:
+            raise KeyError(key)
+        return image
+
+    def discard(self, key: str):
+        """
+        Forgets key, in memory and in the spill.
+        """
+        data = self._data.pop(key, None)
+        if data is not None:
+            self._bytes -= len(data)
+        self._spilled.discard(key)
+        if self.spill is not None and key.startswith("local::"):
+            self.spill.discard(key)
+
+    def _evict(self):
+        # Always keep the entry just added, even if it's bigger than the whole budget
+        while self._bytes > self.max_bytes and len(self._data) > 1:
+            key, data = self._data.popitem(last=False)
+            self._bytes -= len(data)
+            if self.spill is None:
+                continue
+            if key.startswith("local::") or key not in self.spill:
+                self.spill.put(key, data, pinned=key.startswith("local::"))
+            self._spilled.add(key)
@@ -0,0 +1,140 @@
+import hashlib
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import Executor, Future
+from dataclasses import dataclass
+from typing import IO, Callable, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from src.utils.downloader import DEFAULT_LIMITS, DownloadLimits, get_decode_executor, probe_image_size
+from src.utils.thumbnails import thumbnail_from_bytes
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+# Hex chars of the content hash that go into local ids
+ID_HASH_CHARS = 16
+
+# (name, bytes) or (name, callable returning the bytes); callables are read lazily
+Member = Tuple[str, Union[bytes, Callable[[], bytes]]]
+
+
+def local_image_id(name: str, digest: str) -> str:
+    """
+    Stable id for an imported file: the same file imported twice gets the same id.
+    """
+    return f"local::{name}::{digest[:ID_HASH_CHARS]}"
+
+
+def is_image_name(name: str) -> bool:
+    base = os.path.basename(name)
+    # Skip macOS resource forks (__MACOSX/._foo.jpg) and other hidden files
+    return not base.startswith(".") and "__MACOSX" not in name and name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+@dataclass
+class ImportResult:
+    name: str
+    digest: Optional[str] = None
+    data: Optional[bytes] = None
+    thumbnail: Optional[bytes] = None
+    error: Optional[str] = None
+    duplicate: bool = False
+
+    @property
+    def id(self) -> str:
+        return local_image_id(self.name, self.digest)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and not self.duplicate
+
+
+def inspect_image(name: str, data: bytes, thumb_size: Optional[int] = None,
+                  limits: DownloadLimits = DEFAULT_LIMITS) -> ImportResult:
+    """
+    Hashes and validates one file, and makes its thumbnail (which also proves it decodes).
+    Runs on a worker.
+    """
+    if len(data) > limits.max_bytes:
+        return ImportResult(name, error=f"too many bytes ({len(data)})")
+    size = probe_image_size(data)
+    if size is None:
+        return ImportResult(name, error="not an image")
+    reason = limits.check_dimensions(*size)
+    if reason is not None:
+        return ImportResult(name, error=reason)
+
+    digest = hashlib.sha256(data).hexdigest()
+    thumbnail = None
+    if thumb_size:
+        thumbnail = thumbnail_from_bytes(data, thumb_size)
+        if thumbnail is None:
+            return ImportResult(name, digest, error="could not decode")
+    return ImportResult(name, digest, data, thumbnail)
+
+
+def zip_members(source: Union[str, IO[bytes]]) -> Tuple[int, Iterator[Member]]:
+    """
+    (number of images, lazy iterator over them) for a zip file path or file object.
+    Only the central directory is read up front; each member is read when its
+    turn comes, so memory stays at a handful of files whatever the archive size.
+    """
+    archive = zipfile.ZipFile(source)
+    infos = [info for info in archive.infolist() if not info.is_dir() and is_image_name(info.filename)]
+
+    def members() -> Iterator[Member]:
+        with archive:
+            for info in infos:
+                yield info.filename, (lambda info=info: archive.read(info))
+
+    return len(infos), members()
+
+
+def import_images(members: Iterable[Member], known_hashes: Iterable[str] = (),
+                  thumb_size: Optional[int] = None, limits: DownloadLimits = DEFAULT_LIMITS,
+                  executor: Optional[Executor] = None, window: int = 32) -> Iterator[ImportResult]:
+    """
+    Validates, hashes and thumbnails files on a worker pool, yielding results in
+    input order as they finish, so the caller can store them and report progress.
+    At most `window` files are read but not yet yielded at any time.
+    Files whose content hash (its first ID_HASH_CHARS chars) is in known_hashes or
+    was seen earlier in this import come back with duplicate=True and no data.
+    """
+    executor = executor or get_decode_executor()
+    seen: Set[str] = {h[:ID_HASH_CHARS] for h in known_hashes}
+    pending = deque()
+
+    def submit(name: str, data):
+        if callable(data):
+            data = data()
+        return executor.submit(inspect_image, name, data, thumb_size, limits)
+
+    def finish(result: ImportResult) -> ImportResult:
+        if result.digest is not None and result.error is None:
+            short = result.digest[:ID_HASH_CHARS]
+            if short in seen:
+                result.duplicate = True
+                result.data = result.thumbnail = None
+            else:
+                seen.add(short)
+        return result
+
+    for name, data in members:
+        try:
+            pending.append(submit(name, data))
+        except Exception as e:
+            # Unreadable member (bad CRC, unsupported compression...), keep going in order
+            failed = Future()
+            failed.set_result(ImportResult(name, error=f"{type(e).__name__}: {e}"))
+            pending.append(failed)
+        if len(pending) >= window:
+            yield finish(pending.popleft().result())
+    while pending:
+        yield finish(pending.popleft().result())
+
+
+def known_local_hashes(ids: Iterable[str]) -> List[str]:
+    """
+    The short content hashes inside a list of local ids, for import_images(known_hashes=...).
+    """
+    return [i.rsplit("::", 1)[-1] for i in ids if i.startswith("local::")]
@@ -0,0 +1,156 @@
+import asyncio
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Dict, List, Optional, Sequence, Union
+
+import aiohttp
+import numpy as np
+from PIL import Image
+
+from src.ai.embedding_store import EmbeddingStore, encode_with_store
+from src.utils.downloader import (DEFAULT_HEADERS, DEFAULT_LIMITS, DownloadLimits, decode_image,
+                                  fetch_image_bytes, get_decode_executor)
+from src.utils.http_cache import DiskCache
+from src.utils.throttle import HostLimiter
+
+_DONE = object()
+
+# File bytes, or a function that reads them when the pipeline gets to the image
+BytesSource = Union[bytes, Callable[[], Optional[bytes]]]
+
+
+@dataclass
+class EmbeddedBatch:
+    urls: List[str]
+    images: List[Image.Image]
+    embeddings: np.ndarray
+
+
+async def stream_embeddings(urls: Sequence[str], processor, store: EmbeddingStore,
+                            images: Optional[Dict[str, Image.Image]] = None,
+                            image_bytes: Optional[Dict[str, BytesSource]] = None,
+                            session: Optional[aiohttp.ClientSession] = None,
+                            batch_size: int = 32, max_pending: int = 64,
+                            max_connections: int = 20, decode_workers: int = 4,
+                            decode_executor: Optional[Executor] = None,
+                            draft_size: Optional[int] = None,
+                            cache: Optional[DiskCache] = None,
+                            limiter: Optional[HostLimiter] = None,
+                            limits: DownloadLimits = DEFAULT_LIMITS) -> AsyncIterator[EmbeddedBatch]:
+    """
+    Download -> decode -> embed as a streaming pipeline, yielding batches as soon as they're ready.
+
+    urls are downloaded (at most max_connections at a time, with retries and an
+    adaptive limit per host, see fetch_image), decoded on decode_executor
+    (default: the downloader's shared pool, decode_workers at a time) and handed
+    to the model in micro-batches of batch_size while later downloads are still
+    in flight. `image_bytes` are files already at hand (e.g. local imports) that
+    only need decoding; pass loaders to read them one at a time as the decoders
+    get to them. A loader that comes back empty (e.g. a cache entry evicted since)
+    is downloaded instead if its key is an http(s) URL. `images` are already
+    decoded and skip straight to the embedding stage. Bounded queues between the stages apply
+    backpressure, so memory stays flat however many urls there are.
+    draft_size is passed on to decode_image, so the yielded images are only fit for
+    embedding/thumbnails when it's set. With a DiskCache, downloads go through it
+    (see fetch_image_bytes). Pass a long-lived session and limiter (see
+    http_session.SessionManager) to keep connections and per-host limits warm
+    between calls. Downloads outside `limits` are rejected early (see DownloadLimits);
+    those and other failed downloads/decodes are dropped.
+    """
+    loop = asyncio.get_running_loop()
+    images = images or {}
+    image_bytes = image_bytes or {}
+    limiter = limiter or HostLimiter()
+    decode_q: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+    ready_q: asyncio.Queue = asyncio.Queue(maxsize=2 * batch_size)
+
+    decoder = decode_executor or get_decode_executor()
+    # Inference gets its own thread so decoding keeps going while the model runs
+    encoder = ThreadPoolExecutor(max_workers=1)
+
+    async def download(session: aiohttp.ClientSession, slots: asyncio.Semaphore):
+        async def one(url: str):
+            _, data = await fetch_image_bytes(session, url, cache, limiter, limits=limits, slots=slots)
+            if data is not None:
+                # Blocks while the decoders are behind
+                await decode_q.put((url, data))
+
+        await asyncio.gather(*(one(u) for u in urls))
+
+    async def decode_worker(session: aiohttp.ClientSession, slots: asyncio.Semaphore):
+        while True:
+            item = await decode_q.get()
+            if item is _DONE:
+                return
+            url, data = item
+            if callable(data):
+                data = await loop.run_in_executor(decoder, data)
+                if data is None and url.startswith(("http://", "https://")):
+                    _, data = await fetch_image_bytes(session, url, cache, limiter, limits=limits, slots=slots)
+                if data is None:
+                    continue
+            image = await loop.run_in_executor(decoder, decode_image, data, draft_size)
+            if image is not None:
+                await ready_q.put((url, image))
+
+    async def feed_preloaded():
+        for url, data in image_bytes.items():
+            await decode_q.put((url, data))
+        for url, image in images.items():
+            await ready_q.put((url, image))
+
+    async def run_stages(session: aiohttp.ClientSession):
+        # Only held around the requests themselves, see fetch_image
+        slots = asyncio.Semaphore(max_connections)
+        decoders = [asyncio.create_task(decode_worker(session, slots)) for _ in range(decode_workers)]
+        try:
+            await asyncio.gather(feed_preloaded(), download(session, slots))
+            for _ in decoders:
+                await decode_q.put(_DONE)
+            await asyncio.gather(*decoders)
+        except BaseException:
+            for task in decoders:
+                task.cancel()
+            raise
+
+    async def produce():
+        try:
+            if session is not None:
+                await run_stages(session)
+            else:
+                connector = aiohttp.TCPConnector(limit=max_connections)
+                async with aiohttp.ClientSession(connector=connector, headers=DEFAULT_HEADERS) as own_session:
+                    await run_stages(own_session)
+        except asyncio.CancelledError:
+            # The consumer went away, nobody is reading the queues anymore (run_stages
+            # has cancelled the decoders)
+            raise
+        except Exception:
+            # Still end the stream; the consumer re-raises this when it awaits us
+            await ready_q.put(_DONE)
+            raise
+        await ready_q.put(_DONE)
+
+    def embed(batch) -> EmbeddedBatch:
+        batch_urls = [u for u, _ in batch]
+        batch_images = [img for _, img in batch]
+        return EmbeddedBatch(batch_urls, batch_images, encode_with_store(processor, store, batch_images))
+
+    producer = asyncio.create_task(produce())
+    try:
+        batch = []
+        while True:
+            item = await ready_q.get()
+            if item is _DONE:
+                break
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield await loop.run_in_executor(encoder, embed, batch)
+                batch = []
+        if batch:
+            yield await loop.run_in_executor(encoder, embed, batch)
+        await producer
+    finally:
+        if not producer.done():
+            producer.cancel()
+        encoder.shutdown(wait=False)
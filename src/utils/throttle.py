@@ -0,0 +1,131 @@
+import asyncio
+import random
+import time
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Dict, FrozenSet, Optional
+from urllib.parse import urlsplit
+
+
+@dataclass
+class RetryPolicy:
+    """
+    When and how long to wait before retrying a request.
+    Delays grow exponentially with full jitter, so clients throttled together
+    don't all come back at the same moment.
+    """
+    max_attempts: int = 4
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+    retry_statuses: FrozenSet[int] = field(default_factory=lambda: frozenset({408, 429, 500, 502, 503, 504}))
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Delay before retry number `attempt` (1-based).
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+def parse_retry_after(value: Optional[str], cap: float = 120.0) -> Optional[float]:
+    """
+    Seconds to wait from a Retry-After header (delta-seconds or HTTP date), capped.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), cap)
+
+
+class AIMDLimiter:
+    """
+    Concurrency limit that adapts like TCP congestion control:
+    every success adds 1/limit (so +1 per "window" of requests), every throttling
+    signal (429, 503, timeout) halves it. Decreases are spaced by `cooldown` seconds
+    so one burst of 429s from requests already in flight only counts once.
+    pause() stops new requests entirely until a Retry-After deadline.
+    """
+
+    def __init__(self, initial: int = 16, minimum: int = 1, maximum: int = 32, cooldown: float = 1.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._cond: Optional[asyncio.Condition] = None
+
+    @property
+    def _condition(self) -> asyncio.Condition:
+        # Created lazily so the limiter can be built outside the loop that uses it
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self):
+        async with self._condition:
+            while True:
+                delay = self._paused_until - time.monotonic()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                await self._condition.wait()
+
+    async def release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.release()
+
+    def on_success(self):
+        self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def on_throttle(self):
+        now = time.monotonic()
+        if now - self._last_decrease >= self.cooldown:
+            self.limit = max(self.minimum, self.limit / 2)
+            self._last_decrease = now
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class HostLimiter:
+    """
+    One AIMDLimiter per host, so a CDN throttling us doesn't slow down the others.
+    Hosts start at about the fixed concurrency we used before (10-20), since most
+    scrapes pull everything from a single CDN, and only back off once throttled.
+    """
+
+    def __init__(self, initial: int = 16, minimum: int = 1, maximum: int = 32, cooldown: float = 1.0):
+        self._kwargs = dict(initial=initial, minimum=minimum, maximum=maximum, cooldown=cooldown)
+        self._hosts: Dict[str, AIMDLimiter] = {}
+
+    def for_url(self, url: str) -> AIMDLimiter:
+        host = urlsplit(url).netloc.lower()
+        limiter = self._hosts.get(host)
+        if limiter is None:
+            limiter = self._hosts[host] = AIMDLimiter(**self._kwargs)
+        return limiter
+
+    def limits(self) -> Dict[str, float]:
+        return {host: limiter.limit for host, limiter in self._hosts.items()}
@@ -0,0 +1,132 @@
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from typing import Callable, Optional
+
+from PIL import Image
+
+from src.utils.http_cache import DiskCache
+
+DEFAULT_SIZE = 320
+DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+
+
+def make_thumbnail(image: Image.Image, size: int = DEFAULT_SIZE, fmt: str = "WEBP", quality: int = 80) -> bytes:
+    """
+    Encodes image scaled down to fit in size x size (never up), as WEBP or JPEG.
+    """
+    image = image.copy() if image.mode == "RGB" else image.convert("RGB")
+    image.thumbnail((size, size))
+    buffer = BytesIO()
+    image.save(buffer, format=fmt, quality=quality)
+    return buffer.getvalue()
+
+
+def thumbnail_from_bytes(data: bytes, size: int = DEFAULT_SIZE, fmt: str = "WEBP", quality: int = 80) -> Optional[bytes]:
+    """
+    make_thumbnail straight from file bytes, decoding JPEGs in draft mode.
+    None if data isn't a readable image.
+    """
+    try:
+        image = Image.open(BytesIO(data))
+        image.draft("RGB", (size, size))
+        return make_thumbnail(image, size, fmt, quality)
+    except Exception:
+        return None
+
+
+class ThumbnailCache:
+    """
+    Small encoded previews for the gallery grids, made once per image.
+
+    Thumbnails are kept in an in-memory LRU (bounded by memory_bytes) and persisted
+    in the disk cache under "thumb::<size>::<format>::<key>", so they survive
+    restarts and never cost a full-resolution decode again.
+    Shared between sessions, safe to use from several threads.
+    """
+
+    def __init__(self, size: int = DEFAULT_SIZE, fmt: str = "WEBP", quality: int = 80,
+                 store: Optional[DiskCache] = None, memory_bytes: int = DEFAULT_MEMORY_BYTES):
+        if fmt not in ("WEBP", "JPEG"):
+            raise ValueError(f"Unsupported thumbnail format {fmt!r}, expected 'WEBP' or 'JPEG'.")
+        self.size = size
+        self.fmt = fmt
+        self.quality = quality
+        self.store = store
+        self.memory_bytes = memory_bytes
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes = 0
+
+    def _store_key(self, key: str) -> str:
+        return f"thumb::{self.size}::{self.fmt}::{key}"
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            if key in self._memory:
+                return True
+        return self.store is not None and self._store_key(key) in self.store
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        The thumbnail for key if one was made before, else None.
+        """
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data
+        if self.store is None:
+            return None
+        data = self.store.get(self._store_key(key))
+        if data is not None:
+            self._remember(key, data)
+        return data
+
+    def put(self, key: str, thumbnail: bytes):
+        self._remember(key, thumbnail)
+        if self.store is not None:
+            self.store.put(self._store_key(key), thumbnail)
+
+    def put_bytes(self, key: str, data: bytes) -> Optional[bytes]:
+        """
+        Makes and stores the thumbnail for a file's bytes. Returns it, or None if undecodable.
+        """
+        thumbnail = thumbnail_from_bytes(data, self.size, self.fmt, self.quality)
+        if thumbnail is not None:
+            self.put(key, thumbnail)
+        return thumbnail
+
+    def put_image(self, key: str, image: Image.Image) -> bytes:
+        thumbnail = make_thumbnail(image, self.size, self.fmt, self.quality)
+        self.put(key, thumbnail)
+        return thumbnail
+
+    def get_or_make(self, key: str, load: Callable[[], Optional[bytes]]) -> Optional[bytes]:
+        """
+        The thumbnail for key, made from load()'s file bytes the first time.
+        """
+        thumbnail = self.get(key)
+        if thumbnail is not None:
+            return thumbnail
+        data = load()
+        return self.put_bytes(key, data) if data is not None else None
+
+    def discard(self, key: str):
+        with self._lock:
+            data = self._memory.pop(key, None)
+            if data is not None:
+                self._bytes -= len(data)
+        if self.store is not None:
+            self.store.discard(self._store_key(key))
+
+    def _remember(self, key: str, thumbnail: bytes):
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._memory[key] = thumbnail
+            self._bytes += len(thumbnail)
+            while self._bytes > self.memory_bytes and len(self._memory) > 1:
+                _, evicted = self._memory.popitem(last=False)
+                self._bytes -= len(evicted)
@@ -0,0 +1,137 @@
+import threading
+
+import numpy as np
+
+from src.ai import ann
+from src.ai.ann import IVFIndex
+from src.ai.index import EmbeddingIndex
+
+DIM = 16
+
+
+def clustered(n: int, seed: int = 0, clusters: int = 8) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, DIM))
+    return centers[rng.integers(clusters, size=n)] + 0.05 * rng.normal(size=(n, DIM))
+
+
+def urls(start: int, stop: int):
+    return [f"u{i}" for i in range(start, stop)]
+
+
+def check_lists(index: IVFIndex):
+    """
+    Every live row is in exactly one inverted list, the one _assign says.
+    """
+    n = len(index)
+    members = sorted(r for lst in index._lists for r in lst)
+    assert members == list(range(n))
+    for c, lst in enumerate(index._lists):
+        assert all(index._assign[r] == c for r in lst)
+    assert (index._assign[n:] == -1).all()
+
+
+def finds_itself(index: IVFIndex, url: str) -> bool:
+    return index.search_vector(index.get(url), k=1)[0][0] == url
+
+
+def test_untrained_index_is_exact():
+    x = clustered(200)
+    ivf, exact = IVFIndex(train_threshold=1000), EmbeddingIndex()
+    ivf.add_many(urls(0, 200), x)
+    exact.add_many(urls(0, 200), x)
+    assert not ivf.trained
+    assert ivf.search_vector(x[3], k=10) == exact.search_vector(x[3], k=10)
+
+
+def test_full_ranking_is_exact_when_trained():
+    x = clustered(500)
+    index = IVFIndex(train_threshold=100, nprobe=1, background=False)
+    index.add_many(urls(0, 500), x)
+    assert index.trained
+    ranking = index.search_vector(x[0], k=None)
+    assert len(ranking) == 500 and ranking[0][0] == "u0"
+
+
+def test_remove_patches_lists_after_swapping_the_last_row():
+    x = clustered(300)
+    index = IVFIndex(train_threshold=100, nlist=8, nprobe=8, background=False)
+    index.add_many(urls(0, 300), x)
+    check_lists(index)
+
+    # The last row, a middle row (last moves into it) and the first row
+    index.remove(["u299", "u150", "u0", "missing"])
+    assert len(index) == 297 and "u150" not in index
+    check_lists(index)
+    assert all(finds_itself(index, u) for u in ["u298", "u1", "u149", "u151"])
+
+
+def test_add_many_overwrites_existing_rows():
+    x = clustered(300)
+    index = IVFIndex(train_threshold=100, nlist=8, nprobe=1, background=False)
+    index.add_many(urls(0, 300), x)
+    before = index._assign[index.rows_for(["u5"])[0]]
+
+    # Move u5 onto another cluster's vector, plus a new row, in one call
+    far = next(i for i in range(300) if index._assign[i] != before)
+    index.add_many(["u5", "u300"], np.stack([x[far], x[7] + 0.02]))
+    assert len(index) == 301
+    check_lists(index)
+    assert index._assign[index.rows_for(["u5"])[0]] == index._assign[far]
+    assert finds_itself(index, "u300")
+
+
+def test_background_training_installs_over_adds_and_removes(monkeypatch):
+    release = threading.Event()
+    kmeans = ann.spherical_kmeans
+
+    def slow_kmeans(*args, **kwargs):
+        release.wait(10)
+        return kmeans(*args, **kwargs)
+
+    monkeypatch.setattr(ann, "spherical_kmeans", slow_kmeans)
+    x = clustered(600)
+    index = IVFIndex(train_threshold=200, nlist=8, nprobe=8)
+    index.add_many(urls(0, 200), x[:200])
+    assert index.training and not index.trained
+
+    # Rows added and removed while k-means runs on the sample taken above
+    index.add_many(urls(200, 600), x[200:])
+    index.remove(urls(0, 50) + ["u599"])
+    assert not index.trained
+    release.set()
+    index._training.result(10)
+
+    index.search_vector(x[100], k=5)
+    assert index.trained and not index.training
+    assert len(index) == 549
+    check_lists(index)
+    assert all(finds_itself(index, u) for u in ["u50", "u300", "u598"])
+
+
+def test_mixed_adds_removes_and_retrains_keep_every_row_in_one_list():
+    rng = np.random.default_rng(1)
+    x = clustered(3000, seed=1)
+    for background in (False, True):
+        index = IVFIndex(train_threshold=100, nlist=8, retrain_factor=2.0, background=background)
+        live = set()
+        for step in range(60):
+            op = rng.integers(3)
+            ids = rng.choice(3000, size=int(rng.integers(1, 80)), replace=False)
+            if op == 0 or not live:
+                index.add_many([f"u{i}" for i in ids], x[ids])
+                live.update(int(i) for i in ids)
+            elif op == 1:
+                # Overwrite rows that exist with other rows' vectors
+                keys = sorted(live)[:len(ids)]
+                index.add_many([f"u{i}" for i in keys], x[ids[:len(keys)]])
+            else:
+                gone = rng.choice(sorted(live), size=min(len(live), len(ids)), replace=False)
+                index.remove([f"u{i}" for i in gone])
+                live.difference_update(int(i) for i in gone)
+            if step % 20 == 19 and index.training:
+                index._training.result(30)
+            index.search_vector(x[0], k=3)
+            assert sorted(index.urls) == sorted(f"u{i}" for i in live)
+            if index.trained:
+                check_lists(index)
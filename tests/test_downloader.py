@@ -0,0 +1,109 @@
+import asyncio
+import io
+import time
+
+import aiohttp
+from aiohttp import web
+from PIL import Image
+
+from src.utils.downloader import fetch_image, prefetch_images
+from src.utils.http_cache import DiskCache
+from src.utils.throttle import HostLimiter, RetryPolicy
+
+
+def jpeg() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (200, 100), (40, 80, 120)).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def with_server(routes, fn):
+    """
+    Runs `await fn(base_url)` against a local server with the given {path: handler} routes.
+    """
+    async def go():
+        app = web.Application()
+        for path, handler in routes.items():
+            app.router.add_get(path, handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            return await fn(f"http://127.0.0.1:{port}")
+        finally:
+            await runner.cleanup()
+    return asyncio.run(go())
+
+
+def test_prefetch_stores_raw_bytes(tmp_path):
+    body = jpeg()
+
+    async def image(request):
+        return web.Response(body=body, content_type="image/jpeg")
+
+    async def missing(request):
+        return web.Response(status=404)
+
+    cache = DiskCache(str(tmp_path))
+
+    async def prefetch(base):
+        return base, await prefetch_images([f"{base}/a.jpg", f"{base}/gone.jpg"], cache)
+
+    base, failures = with_server({"/a.jpg": image, "/gone.jpg": missing}, prefetch)
+
+    assert list(failures) == [f"{base}/gone.jpg"] and failures[f"{base}/gone.jpg"].reason == "HTTP 404"
+    # Byte for byte what the server sent, nothing re-encoded
+    assert cache.get(f"{base}/a.jpg") == body
+    assert f"{base}/gone.jpg" not in cache
+
+
+
+def test_stale_entry_is_revalidated_with_a_conditional_get(tmp_path):
+    body = jpeg()
+    seen = []
+
+    async def image(request):
+        seen.append(request.headers.get("If-None-Match"))
+        if request.headers.get("If-None-Match") == '"v1"':
+            return web.Response(status=304, headers={"Cache-Control": "max-age=60"})
+        return web.Response(body=body, content_type="image/jpeg",
+                            headers={"ETag": '"v1"', "Cache-Control": "max-age=0"})
+
+    cache = DiskCache(str(tmp_path))
+
+    async def fetch_three_times(base):
+        async with aiohttp.ClientSession() as session:
+            return [await fetch_image(session, f"{base}/a.jpg", cache) for _ in range(3)]
+
+    results = with_server({"/a.jpg": image}, fetch_three_times)
+
+    assert [data for data, _ in results] == [body] * 3
+    # Stored stale, then a 304 makes it fresh, then it's served from disk without a request
+    assert seen == [None, '"v1"']
+
+
+def test_retry_after_is_honored_and_shrinks_the_host_limit(tmp_path):
+    body = jpeg()
+    calls = []
+
+    async def throttled_once(request):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            return web.Response(status=429, headers={"Retry-After": "1"})
+        return web.Response(body=body, content_type="image/jpeg")
+
+    limiter = HostLimiter(initial=16)
+
+    async def fetch(base):
+        async with aiohttp.ClientSession() as session:
+            return await fetch_image(session, f"{base}/a.jpg", limiter=limiter,
+                                     retry=RetryPolicy(max_attempts=3, base_delay=0))
+
+    data, failure = with_server({"/a.jpg": throttled_once}, fetch)
+
+    assert data == body and failure is None
+    assert len(calls) == 2 and calls[1] - calls[0] >= 0.95
+    # Halved by the 429, then one success's worth of additive increase
+    assert 8 <= list(limiter.limits().values())[0] < 9
@@ -0,0 +1,162 @@
+import io
+import json
+import os
+import tarfile
+
+import pytest
+from PIL import Image
+
+from src.utils.export_manifest import MANIFEST_NAME, ExportManifest, sync_dataset_dir, sync_webdataset
+from src.utils.exporter import ExportEntry
+
+
+def jpeg(shade: int) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (80, 60), (shade, shade, shade)).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+class Sources:
+    """
+    Image sources that count how often they're read.
+    """
+
+    def __init__(self):
+        self.reads = []
+
+    def entry(self, i: int, caption: str = None) -> ExportEntry:
+        def load():
+            self.reads.append(i)
+            return jpeg(i * 10)
+        return ExportEntry(f"img_{i}", load, caption or f"query {i}", url=f"https://example.com/{i}.jpg",
+                           key=f"https://example.com/{i}.jpg")
+
+    def entries(self, ids, caption: str = None):
+        return [self.entry(i, caption) for i in ids]
+
+
+def shard_samples(directory: str):
+    samples = {}
+    for shard in sorted(f for f in os.listdir(directory) if f.endswith(".tar")):
+        with tarfile.open(os.path.join(directory, shard)) as tar:
+            samples[shard] = sorted({name.split(".", 1)[0] for name in tar.getnames()})
+    return samples
+
+
+def test_sync_dir_add_remove_readd(tmp_path):
+    directory = str(tmp_path)
+    sources = Sources()
+
+    result = sync_dataset_dir(sources.entries([0, 1, 2]), directory)
+    assert (result.added, result.removed, result.kept) == (3, 0, 0)
+    manifest = ExportManifest.read(directory)
+    names = {key: item["name"] for key, item in manifest.items.items()}
+    assert sorted(os.listdir(directory)) == sorted(
+        [MANIFEST_NAME] + list(names.values()) + [n.replace(".jpg", ".txt") for n in names.values()])
+    with open(os.path.join(directory, names["https://example.com/1.jpg"].replace(".jpg", ".txt"))) as f:
+        assert f.read() == "query 1"
+
+    # Drop 1: its files go, the others aren't even read
+    sources.reads.clear()
+    result = sync_dataset_dir(sources.entries([0, 2]), directory)
+    assert (result.added, result.removed, result.kept) == (0, 1, 2)
+    assert sources.reads == []
+    removed = names["https://example.com/1.jpg"]
+    assert not os.path.exists(os.path.join(directory, removed))
+    assert "https://example.com/1.jpg" not in ExportManifest.read(directory).items
+
+    # Bring it back: same content hash, same name
+    result = sync_dataset_dir(sources.entries([0, 1, 2]), directory)
+    assert (result.added, result.removed, result.kept) == (1, 0, 2)
+    assert sources.reads == [1]
+    assert os.path.exists(os.path.join(directory, removed))
+    assert len(ExportManifest.read(directory).items) == 3
+
+
+def test_sync_dir_same_image_under_two_keys(tmp_path):
+    directory = str(tmp_path)
+    sources = Sources()
+    twin = sources.entry(0)._replace(key="local::copy.jpg::abc", url=None)
+
+    sync_dataset_dir([sources.entry(0), twin], directory)
+    assert len([f for f in os.listdir(directory) if f.endswith(".jpg")]) == 1
+
+    # Dropping one key keeps the file the other still uses
+    result = sync_dataset_dir([twin], directory)
+    assert result.removed == 1
+    assert len([f for f in os.listdir(directory) if f.endswith(".jpg")]) == 1
+
+
+def test_sync_dir_new_options_start_over(tmp_path):
+    from src.utils.exporter import ExportOptions
+
+    directory = str(tmp_path)
+    sources = Sources()
+    sync_dataset_dir(sources.entries([0, 1]), directory)
+    result = sync_dataset_dir(sources.entries([0, 1]), directory, options=ExportOptions(format="PNG"))
+    assert result.added == 2
+    assert sorted(f.rsplit(".", 1)[1] for f in os.listdir(directory) if f != MANIFEST_NAME) == ["png", "png", "txt", "txt"]
+
+
+def test_sync_webdataset_add_remove_readd(tmp_path):
+    directory = str(tmp_path)
+    sources = Sources()
+
+    result = sync_webdataset(sources.entries(range(6)), directory, max_shard_count=2)
+    assert result.added == 6
+    manifest = ExportManifest.read(directory)
+    assert manifest.shards == ["000000.tar", "000001.tar", "000002.tar"]
+    samples = shard_samples(directory)
+    assert [len(keys) for keys in samples.values()] == [2, 2, 2]
+    assert all(item["name"] in samples[item["shard"]] for item in manifest.items.values())
+
+    # Unchanged basket: nothing is read or rewritten
+    mtimes = {s: os.path.getmtime(os.path.join(directory, s)) for s in manifest.shards}
+    sources.reads.clear()
+    result = sync_webdataset(sources.entries(range(6)), directory, max_shard_count=2)
+    assert (result.added, result.removed, result.kept) == (0, 0, 6)
+    assert sources.reads == []
+    assert {s: os.path.getmtime(os.path.join(directory, s)) for s in manifest.shards} == mtimes
+
+    # Remove 0 (in shard 0) and 2 and 3 (all of shard 1): shard 0 is rewritten, shard 1 deleted
+    gone = manifest.items["https://example.com/0.jpg"]["name"]
+    result = sync_webdataset(sources.entries([1, 4, 5]), directory, max_shard_count=2)
+    assert (result.added, result.removed, result.kept) == (0, 3, 3)
+    manifest = ExportManifest.read(directory)
+    assert manifest.shards == ["000000.tar", "000002.tar"]
+    samples = shard_samples(directory)
+    assert gone not in samples["000000.tar"] and len(samples["000000.tar"]) == 1
+    assert os.path.getmtime(os.path.join(directory, "000002.tar")) == mtimes["000002.tar"]
+
+    # Re-add 0: it goes into a new shard after the existing ones
+    result = sync_webdataset(sources.entries([0, 1, 4, 5]), directory, max_shard_count=2)
+    assert (result.added, result.kept) == (1, 3)
+    manifest = ExportManifest.read(directory)
+    assert manifest.shards == ["000000.tar", "000002.tar", "000003.tar"]
+    assert manifest.items["https://example.com/0.jpg"]["shard"] == "000003.tar"
+    with tarfile.open(os.path.join(directory, "000003.tar")) as tar:
+        meta = json.loads(tar.extractfile(f"{gone}.json").read())
+    assert meta["caption"] == "query 0" and meta["url"] == "https://example.com/0.jpg"
+
+
+def test_sync_webdataset_resumes_after_interruption(tmp_path):
+    directory = str(tmp_path)
+    sources = Sources()
+
+    def broken():
+        raise KeyboardInterrupt()
+
+    entries = sources.entries(range(5)) + [ExportEntry("broken", broken, key="broken")]
+    with pytest.raises(KeyboardInterrupt):
+        sync_webdataset(entries, directory, max_shard_count=2)
+    # Only complete shards are listed, and no partial shard is left behind
+    manifest = ExportManifest.read(directory)
+    assert manifest.shards == ["000000.tar", "000001.tar"]
+    assert len(manifest.items) == 4
+    assert sorted(os.listdir(directory)) == ["000000.tar", "000001.tar", MANIFEST_NAME]
+
+    sources.reads.clear()
+    result = sync_webdataset(sources.entries(range(5)), directory, max_shard_count=2)
+    assert (result.added, result.kept) == (1, 4)
+    assert sources.reads == [4]
+    assert ExportManifest.read(directory).shards == ["000000.tar", "000001.tar", "000002.tar"]
@@ -0,0 +1,28 @@
+import io
+import sys
+import types
+
+from PIL import Image
+
+from src.utils.exporter import ExportOptions, make_export_executor, prepare_image
+
+
+def test_export_workers_dont_rerun_the_main_script(tmp_path, monkeypatch):
+    # Streamlit runs app.py under a stand-in __main__ whose __file__ is the script
+    marker = tmp_path / "ran"
+    script = tmp_path / "app.py"
+    script.write_text(f"open({str(marker)!r}, 'w').close()\n")
+    main = types.ModuleType("__main__")
+    main.__file__ = str(script)
+    monkeypatch.setitem(sys.modules, "__main__", main)
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (640, 480), (10, 20, 30)).save(buffer, format="PNG")
+    executor = make_export_executor(max_workers=2)
+    try:
+        data, ext = executor.submit(prepare_image, buffer.getvalue(), ExportOptions(target_size=128, format="JPEG")).result(60)
+    finally:
+        executor.shutdown()
+
+    assert ext == "jpg" and Image.open(io.BytesIO(data)).size == (128, 96)
+    assert not marker.exists()
@@ -0,0 +1,73 @@
+import time
+
+from src.utils.http_cache import DiskCache
+
+
+def body(i: int, size: int = 1000) -> bytes:
+    return bytes([i]) * size
+
+
+def put_in_order(cache: DiskCache, items):
+    # Distinct access times, so LRU order is well defined
+    for url, data, pinned in items:
+        cache.put(url, data, pinned=pinned)
+        time.sleep(0.01)
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=3000)
+    put_in_order(cache, [("a", body(1), False), ("b", body(2), False), ("c", body(3), False)])
+    assert cache.get("a") == body(1)  # a is now the most recently used
+    time.sleep(0.01)
+
+    cache.put("d", body(4))
+    # Over budget: oldest blobs go until it's down to 90%
+    assert "a" in cache and "d" in cache
+    assert "b" not in cache and "c" not in cache
+    assert cache.total_bytes == 2000
+    # Evicted blobs are deleted from disk too
+    assert len([p for p in (tmp_path / "objects").rglob("*") if p.is_file()]) == 2
+
+
+def test_same_body_is_stored_once(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=10_000)
+    first = cache.put("https://cdn1/x.jpg", body(1))
+    second = cache.put("https://cdn2/x.jpg?utm=1", body(1))
+    assert first == second and cache.total_bytes == 1000 and len(cache) == 2
+
+    # The blob stays while another url still points at it
+    cache.discard("https://cdn1/x.jpg")
+    assert cache.get("https://cdn2/x.jpg?utm=1") == body(1)
+    cache.discard("https://cdn2/x.jpg?utm=1")
+    assert cache.total_bytes == 0 and len(cache) == 0
+
+
+def test_pinned_entries_are_never_evicted(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=3500)
+    put_in_order(cache, [("local::a", body(1), True), ("b", body(2), False),
+                         ("local::c", body(3), True), ("d", body(4), False)])
+    assert "local::a" in cache and "local::c" in cache
+    assert "b" not in cache and "d" in cache
+
+    # Over budget with only pinned entries left to evict: they stay anyway
+    cache.put("local::e", body(5), pinned=True)
+    assert all(k in cache for k in ["local::a", "local::c", "local::e"])
+    cache.close()
+
+    # Pins only last for the process: a reopened cache may evict them
+    reopened = DiskCache(str(tmp_path), max_bytes=3500)
+    reopened.put("f", body(6))
+    assert reopened.total_bytes <= 3500
+    assert "local::a" not in reopened
+
+
+def test_no_store_and_expiry(tmp_path):
+    cache = DiskCache(str(tmp_path), fresh_for=100)
+    assert cache.put("a", body(1), cache_control="no-store") is None and "a" not in cache
+
+    cache.put("b", body(2), cache_control="public, max-age=0")
+    assert not cache.lookup("b").fresh
+    cache.revalidated("b", "max-age=60")
+    assert cache.lookup("b").fresh
+    cache.put("c", body(3))
+    assert cache.lookup("c").expires_at > time.time() + 90
@@ -0,0 +1,70 @@
+import asyncio
+import io
+
+import numpy as np
+from aiohttp import web
+from PIL import Image
+
+from src.ai.embedding_store import EmbeddingStore
+from src.utils.pipeline import stream_embeddings
+
+
+def png(shade: int) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (96, 96), (shade, 0, 0)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class Processor:
+    def encode_images(self, images):
+        return np.array([[img.getpixel((0, 0))[0], 1.0] for img in images], dtype=np.float32)
+
+
+def run_pipeline(image_bytes, store):
+    async def go():
+        return [batch async for batch in stream_embeddings([], Processor(), store, image_bytes=image_bytes,
+                                                           batch_size=2, decode_workers=2)]
+    return asyncio.run(go())
+
+
+def test_loaders_are_read_lazily(tmp_path):
+    calls = []
+
+    def loader(shade):
+        def load():
+            calls.append(shade)
+            return png(shade)
+        return load
+
+    image_bytes = {"local::a": png(1), "local::gone": lambda: None}
+    image_bytes.update({f"local::{i}": loader(i) for i in range(10, 15)})
+    batches = run_pipeline(image_bytes, EmbeddingStore("test", root=str(tmp_path)))
+
+    urls = [u for batch in batches for u in batch.urls]
+    assert sorted(urls) == sorted(["local::a"] + [f"local::{i}" for i in range(10, 15)])
+    assert sorted(calls) == list(range(10, 15))
+
+
+def test_evicted_url_is_downloaded_again(tmp_path):
+    async def serve(request):
+        return web.Response(body=png(7), content_type="image/png")
+
+    async def go():
+        app = web.Application()
+        app.router.add_get("/img.png", serve)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        url = f"http://127.0.0.1:{port}/img.png"
+        try:
+            batches = [b async for b in stream_embeddings([], Processor(), EmbeddingStore("test", root=str(tmp_path)),
+                                                          image_bytes={url: lambda: None})]
+        finally:
+            await runner.cleanup()
+        return url, batches
+
+    url, batches = asyncio.run(go())
+    assert [u for b in batches for u in b.urls] == [url]
+    assert batches[0].embeddings[0][0] == 7
@@ -0,0 +1,87 @@
+import asyncio
+import time
+from email.utils import formatdate
+
+import pytest
+
+from src.utils.throttle import AIMDLimiter, HostLimiter, RetryPolicy, parse_retry_after
+
+
+def test_additive_increase_multiplicative_decrease():
+    limiter = AIMDLimiter(initial=4, minimum=1, maximum=6, cooldown=0)
+    for _ in range(4):
+        limiter.on_success()
+    # +1/limit per success: about +1 per window of `limit` requests
+    assert limiter.limit == pytest.approx(4.93, abs=0.01)
+    for _ in range(100):
+        limiter.on_success()
+    assert limiter.limit == 6
+
+    limiter.on_throttle()
+    assert limiter.limit == 3
+    for _ in range(5):
+        limiter.on_throttle()
+    assert limiter.limit == 1
+
+
+def test_throttles_within_the_cooldown_count_once():
+    limiter = AIMDLimiter(initial=16, cooldown=60)
+    for _ in range(10):
+        limiter.on_throttle()
+    assert limiter.limit == 8
+
+
+def test_acquire_respects_the_limit():
+    limiter = AIMDLimiter(initial=2)
+    peak = 0
+
+    async def job():
+        nonlocal peak
+        async with limiter:
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.01)
+
+    async def go():
+        await asyncio.gather(*(job() for _ in range(10)))
+
+    asyncio.run(go())
+    assert peak == 2 and limiter.in_flight == 0
+
+
+def test_pause_holds_new_requests_until_the_deadline():
+    limiter = AIMDLimiter()
+
+    async def go():
+        limiter.pause(0.2)
+        start = time.monotonic()
+        async with limiter:
+            return time.monotonic() - start
+
+    assert asyncio.run(go()) >= 0.19
+
+
+def test_hosts_are_limited_separately():
+    hosts = HostLimiter(initial=8, cooldown=0)
+    hosts.for_url("https://A.example.com/1.jpg").on_throttle()
+    assert hosts.for_url("https://a.example.com/2.jpg") is hosts.for_url("https://A.example.com/3.jpg")
+    hosts.for_url("https://b.example.com/1.jpg")
+    assert hosts.limits() == {"a.example.com": 4, "b.example.com": 8}
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("5") == 5
+    assert parse_retry_after(" 2.5 ") == 2.5
+    assert parse_retry_after("-3") == 0
+    assert parse_retry_after("100000") == 120
+    assert parse_retry_after(None) is None and parse_retry_after("soon") is None
+    in_ten = parse_retry_after(formatdate(time.time() + 10, usegmt=True))
+    assert 8 <= in_ten <= 10
+    assert parse_retry_after(formatdate(time.time() - 60, usegmt=True)) == 0
+
+
+def test_backoff_is_jittered_and_capped():
+    policy = RetryPolicy(base_delay=0.5, max_delay=3.0)
+    for attempt, ceiling in [(1, 0.5), (2, 1.0), (3, 2.0), (4, 3.0), (10, 3.0)]:
+        delays = [policy.backoff(attempt) for _ in range(200)]
+        assert all(0 <= d <= ceiling for d in delays)
+        assert max(delays) > ceiling / 2
@@ -29,13 +29,13 @@ def test_ai():
 async def test_downloader():
     print("\n--- Testing Downloader ---")
     url = "https://www.google.com/images/branding/googlelogo/2x/googlelogo_color_272x92dp.png"
-    results = await download_images_parallel([url])
-    if url in results and isinstance(results[url], Image.Image):
-        print(f"Downloaded image size: {results[url].size}")
+    report = await download_images_parallel([url])
+    if url in report.images and isinstance(report.images[url], Image.Image):
+        print(f"Downloaded image size: {report.images[url].size}")
         print("Downloader: OK")
-        return results[url]
+        return report.images[url]
     else:
-        print("Downloader Failed")
+        print(f"Downloader Failed: {report.failures.get(url)}")
         return None
 
 def test_exporter(img):